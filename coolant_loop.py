@@ -0,0 +1,277 @@
+from __future__ import division
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+import microchannel_batch as mb
+import coolant_properties as cpp
+
+
+PSI_PER_PA = 1.4504e-4
+MIN_CONDUCTANCE = 1e-12     # [psi/ccm], keeps the Jacobian regular for lossless edges at zero flow
+STAGNANT_FLOW = 1e-9        # edge flows below this fraction of the largest flow carry no heat
+
+
+class CoolantLoop(object):
+    """Network of cold plates, connecting losses and pumps on one coolant loop.
+
+    Nodes are any hashable names and are created on first use. Every element is
+    an edge from one node to another, flow [ccm] is positive in that direction
+    and the pressure drop [psi] along it is
+        plate   a*f*|f| + b*f from the calc_channel_perf c1/c2 quadratic
+        loss    k*f*|f| + r*f
+        pump    -(h0 + h1*f + h2*f^2), the pump curve as a pressure rise
+    The coolant leaves supplyNode (the chiller or reservoir) at supplyT."""
+
+    def __init__(self, coolantName = 'EGW', supplyT = 20, concPercent = 20, supplyNode = None):
+        self.coolantName = coolantName
+        self.supplyT = supplyT
+        self.concPercent = concPercent
+        self.supplyNode = supplyNode    # defaults to the inlet node of the first pump
+        self.nodes = []
+        self.edges = []                 # (name, kind, fromNode, toNode, parameters)
+        self._nodeIndex = {}
+
+    def get_node_index(self, node):
+        if node not in self._nodeIndex:
+            self._nodeIndex[node] = len(self.nodes)
+            self.nodes.append(node)
+        return self._nodeIndex[node]
+
+    def add_edge(self, name, kind, fromNode, toNode, parameters):
+        if name in [edge[0] for edge in self.edges]:
+            raise ValueError('duplicate loop element: {0}'.format(name))
+        self.get_node_index(fromNode)
+        self.get_node_index(toNode)
+        self.edges.append((name, kind, fromNode, toNode, parameters))
+
+    def add_plate(self, name, model, fromNode, toNode, power = 0.0):
+        # a Microchannel cold plate taking power [W]; the plate geometry and wall
+        # material are used, the coolant is the loop coolant
+        self.add_edge(name, 'plate', fromNode, toNode, {'model':model, 'power':power})
+
+    def add_loss(self, name, fromNode, toNode, k = 0.0, r = 0.0):
+        # tubing, fittings or manifolds: k [psi/ccm^2] quadratic, r [psi/ccm] linear
+        self.add_edge(name, 'loss', fromNode, toNode, {'k':k, 'r':r})
+
+    def add_pump(self, name, fromNode, toNode, curve):
+        # curve (h0, h1, h2): pressure rise [psi] = h0 + h1*f + h2*f^2 at flow f [ccm];
+        # the rise should fall with the flow like any real pump curve
+        h = tuple(curve) + (0.0,)*(3 - len(curve))
+        self.add_edge(name, 'pump', fromNode, toNode, {'curve':h})
+        if self.supplyNode == None:
+            self.supplyNode = fromNode
+
+    def solve(self, tolerance = 1e-9, maxIterations = 50, temperatureTolerance = 1e-6,
+              maxTemperatureIterations = 20):
+        # Flow split, pressures and temperatures of the loop. The hydraulics are
+        # solved by Newton's method on edge flows and node pressures with sparse
+        # linear algebra; plate coolant properties follow the plate inlet
+        # temperatures, so hydraulics and heating are alternated until the
+        # temperatures settle.
+        if self.supplyNode == None:
+            raise ValueError('the loop has no pump or supply node')
+        network = LoopNetwork(self)
+        nodeT = np.full(len(self.nodes), float(self.supplyT))
+        q = None
+        p = None
+        numIterations = 0
+        for temperatureIteration in range(maxTemperatureIterations):
+            network.set_plate_temperatures(nodeT, q)
+            q, p, iterations, converged = network.solve_hydraulics(q, p, tolerance, maxIterations)
+            numIterations += iterations
+            newT = network.solve_temperatures(q)
+            change = np.max(np.abs(newT - nodeT))
+            nodeT = newT
+            if change <= temperatureTolerance:
+                break
+        network.set_plate_temperatures(nodeT, q)
+        return network.get_results(q, p, nodeT, converged and change <= temperatureTolerance,
+                                   numIterations, temperatureIteration + 1)
+
+
+class LoopNetwork(object):
+    """Arrays of a CoolantLoop used by the solver"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        numNodes = len(loop.nodes)
+        numEdges = len(loop.edges)
+        self.numNodes = numNodes
+        self.numEdges = numEdges
+        self.fromIndex = np.array([loop.get_node_index(edge[2]) for edge in loop.edges], dtype=np.intp)
+        self.toIndex = np.array([loop.get_node_index(edge[3]) for edge in loop.edges], dtype=np.intp)
+        self.supplyIndex = loop.get_node_index(loop.supplyNode)
+
+        # reduced incidence matrix, +1 where an edge leaves a node and -1 where it
+        # enters, without the supply node row whose pressure is the reference
+        rows = np.concatenate((self.fromIndex, self.toIndex))
+        cols = np.concatenate((np.arange(numEdges), np.arange(numEdges)))
+        values = np.concatenate((np.ones(numEdges), -np.ones(numEdges)))
+        keep = rows != self.supplyIndex
+        self.nodeRow = np.full(numNodes, -1, dtype=np.intp)       # node -> reduced row
+        self.nodeRow[np.arange(numNodes) != self.supplyIndex] = np.arange(numNodes - 1)
+        self.incidence = scipy.sparse.csr_matrix((values[keep], (self.nodeRow[rows[keep]], cols[keep])),
+                                                 shape=(numNodes - 1, numEdges))
+        self.incidenceT = self.incidence.T.tocsr()
+
+        # constant edge coefficients, plate coefficients follow the coolant state
+        kinds = [edge[1] for edge in loop.edges]
+        self.isPlate = np.array([kind == 'plate' for kind in kinds], dtype=bool)
+        self.isPump = np.array([kind == 'pump' for kind in kinds], dtype=bool)
+        self.a = np.zeros(numEdges)     # f*|f| coefficient [psi/ccm^2]
+        self.b = np.zeros(numEdges)     # f coefficient [psi/ccm]
+        self.h = np.zeros((3, numEdges))    # pump curves
+        self.power = np.zeros(numEdges)
+        for n, (name, kind, fromNode, toNode, parameters) in enumerate(loop.edges):
+            if kind == 'loss':
+                self.a[n] = parameters['k']
+                self.b[n] = parameters['r']
+            elif kind == 'pump':
+                self.h[:, n] = parameters['curve']
+            else:
+                self.power[n] = parameters['power']
+
+        self.plateEdges = np.nonzero(self.isPlate)[0]
+        models = [loop.edges[n][4]['model'] for n in self.plateEdges]
+        self.plateColumns = mb.get_batch_columns(models)
+        wc = self.plateColumns['channelWidth']
+        zc = self.plateColumns['channelHeight']
+        D = 4*wc*zc/(2*(zc + wc))			# channel characteristic width [mm]
+        B = (np.pi*(D**2)/4)/(wc*zc)		# cross section shape factor
+        self.plateC = 16*np.exp(0.294*(B**2) + 0.068*B - 0.318)
+        self.plateD = D
+        self.plateFlowArea = self.plateColumns['numSplits']*self.plateColumns['numChannelsPerSplit']*wc*zc*1e-2
+        self.plateCoolant = None
+
+    def set_plate_temperatures(self, nodeT, q = None):
+        # coolant properties and pressure coefficients of the plates at their inlet
+        # temperatures (the upstream node of each plate)
+        inlet = self.fromIndex[self.plateEdges]
+        if q is not None:
+            inlet = np.where(q[self.plateEdges] >= 0, inlet, self.toIndex[self.plateEdges])
+        self.plateCoolant = cpp.calc_coolant_properties(self.loop.coolantName, nodeT[inlet], self.loop.concPercent)
+        rho = self.plateCoolant['rho']
+        mu = self.plateCoolant['mu']
+        c1 = self.plateColumns['headloss']*(rho*1e3)/2
+        c2 = (2*self.plateC*(mu*1e4)*(self.plateColumns['channelLength']*1e-3))/((self.plateD*1e-3)**2)
+        # P = 1.4504e-4*(c1*v^2 + c2*v) with v = 1e-2*(f/60)/flowArea [m/s]
+        s = 1e-2/(60*self.plateFlowArea)
+        self.a[self.plateEdges] = PSI_PER_PA*c1*s*s
+        self.b[self.plateEdges] = PSI_PER_PA*c2*s
+
+    def get_pressure_drop(self, q):
+        # pressure drop along every edge and its derivative with respect to the flow
+        dP = self.a*q*np.abs(q) + self.b*q
+        dPdq = 2*self.a*np.abs(q) + self.b
+        pump = self.isPump
+        dP[pump] = -(self.h[0, pump] + self.h[1, pump]*q[pump] + self.h[2, pump]*q[pump]**2)
+        dPdq[pump] = -(self.h[1, pump] + 2*self.h[2, pump]*q[pump])
+        return dP, np.maximum(dPdq, MIN_CONDUCTANCE)
+
+    def get_residual(self, q, p):
+        # flow balance at the nodes and pressure balance along the edges
+        pFull = np.zeros(self.numNodes)
+        pFull[self.nodeRow >= 0] = p
+        dP, dPdq = self.get_pressure_drop(q)
+        return np.concatenate((self.incidence.dot(q), pFull[self.fromIndex] - pFull[self.toIndex] - dP)), dPdq
+
+    def solve_hydraulics(self, q, p, tolerance, maxIterations):
+        # Newton iteration on the edge flows q and node pressures p with a
+        # backtracking line search on the residual norm. With A the reduced
+        # incidence and G = diag(d(dP)/dq) the Newton step solves
+        #   A dq = -r1,  A' dp - G dq = -r2
+        # and eliminating dq leaves the sparse nodal system
+        #   A G^-1 A' dp = -r1 - A G^-1 r2,  dq = G^-1 (A' dp + r2)
+        numNodes = self.numNodes - 1
+        if q is None:
+            q = np.zeros(self.numEdges)
+        if p is None:
+            p = np.zeros(numNodes)
+        residual, dPdq = self.get_residual(q, p)
+        norm = np.max(np.abs(residual))
+        for iteration in range(maxIterations):
+            if norm <= tolerance*max(1.0, np.max(np.abs(q))):
+                return q, p, iteration, True
+            r1 = residual[:numNodes]
+            r2 = residual[numNodes:]
+            scaled = self.incidence.dot(scipy.sparse.diags(1/dPdq))
+            dp = scipy.sparse.linalg.spsolve(scaled.dot(self.incidenceT).tocsc(), -r1 - scaled.dot(r2))
+            dq = (self.incidenceT.dot(dp) + r2)/dPdq
+            t = 1.0
+            while True:
+                qNew = q + t*dq
+                pNew = p + t*dp
+                residualNew, dPdqNew = self.get_residual(qNew, pNew)
+                normNew = np.max(np.abs(residualNew))
+                if normNew < norm or t < 1e-4:
+                    break
+                t /= 2
+            q, p, residual, dPdq, norm = qNew, pNew, residualNew, dPdqNew, normNew
+        return q, p, maxIterations, norm <= tolerance*max(1.0, np.max(np.abs(q)))
+
+    def solve_temperatures(self, q):
+        # Node temperatures from an energy balance: a node mixes the coolant that
+        # flows in, weighted by the heat capacity rate, and each plate heats its
+        # stream by power*flowRth with flowRth = 1/((f/60)*rho*cp) as in
+        # Coolant.calc_flow_rth; the supply node is held at supplyT.
+        rhoCp = np.ones(self.numEdges)
+        rhoCp[self.plateEdges] = self.plateCoolant['rho']*self.plateCoolant['cp']
+        if len(self.plateEdges) < self.numEdges:
+            # non-plate edges carry the coolant at the supply state
+            supply = cpp.calc_coolant_properties(self.loop.coolantName, self.loop.supplyT, self.loop.concPercent)
+            rhoCp[~self.isPlate] = supply['rho']*supply['cp']
+        # heat capacity rate [W/C]; edges with flows at round-off level of the loop flow
+        # are taken as stagnant so their direction does not flip the energy balance
+        w = np.where(np.abs(q) > STAGNANT_FLOW*np.max(np.abs(q)), (np.abs(q)/60)*rhoCp, 0.0)
+        upstream = np.where(q >= 0, self.fromIndex, self.toIndex)
+        downstream = np.where(q >= 0, self.toIndex, self.fromIndex)
+        heat = np.where(w > 0, self.power, 0.0)
+
+        inflow = np.bincount(downstream, weights=w, minlength=self.numNodes)
+        fixed = (inflow <= 0)
+        fixed[self.supplyIndex] = True
+        into = ~fixed[downstream]
+        rows = np.concatenate((downstream[into], np.nonzero(fixed)[0], np.nonzero(~fixed)[0]))
+        cols = np.concatenate((upstream[into], np.nonzero(fixed)[0], np.nonzero(~fixed)[0]))
+        values = np.concatenate((-w[into], np.ones(np.count_nonzero(fixed)), inflow[~fixed]))
+        matrix = scipy.sparse.csc_matrix((values, (rows, cols)), shape=(self.numNodes, self.numNodes))
+        rhs = np.bincount(downstream[into], weights=heat[into], minlength=self.numNodes)
+        rhs[fixed] = self.loop.supplyT      # the supply and nodes without inflow
+        return scipy.sparse.linalg.spsolve(matrix, rhs)
+
+    def get_results(self, q, p, nodeT, converged, numIterations, numTemperatureIterations):
+        loop = self.loop
+        pFull = np.zeros(self.numNodes)
+        pFull[self.nodeRow >= 0] = p
+        dP = self.get_pressure_drop(q)[0]
+        results = {'converged':bool(converged), 'numIterations':numIterations,
+                   'numTemperatureIterations':numTemperatureIterations}
+        results['nodePressure'] = dict((node, float(pFull[n])) for n, node in enumerate(loop.nodes))
+        results['nodeT'] = dict((node, float(nodeT[n])) for n, node in enumerate(loop.nodes))
+        results['flowRate'] = dict((edge[0], float(q[n])) for n, edge in enumerate(loop.edges))
+        results['pressureDrop'] = dict((edge[0], float(dP[n])) for n, edge in enumerate(loop.edges))
+
+        # full channel performance of every plate at its solved flow and inlet state
+        plates = {}
+        if len(self.plateEdges):
+            columns = dict(self.plateColumns)
+            fPlate = q[self.plateEdges]
+            columns['flowMode'] = np.zeros(len(fPlate), dtype=bool)
+            columns['flowRate'] = np.abs(fPlate)
+            columns['coolantK'] = self.plateCoolant['k']
+            columns['coolantMu'] = self.plateCoolant['mu']
+            columns['coolantRho'] = self.plateCoolant['rho']
+            columns['coolantCp'] = self.plateCoolant['cp']
+            with np.errstate(all='ignore'):
+                perf = mb.calc_channel_perf_batch(**columns)
+                flowRth = 1/((np.abs(fPlate)/60)*self.plateCoolant['rho']*self.plateCoolant['cp'])
+            for i, n in enumerate(self.plateEdges):
+                inlet, outlet = (self.fromIndex[n], self.toIndex[n]) if q[n] >= 0 else (self.toIndex[n], self.fromIndex[n])
+                plate = {'flowRate':float(q[n]), 'pressureDrop':float(dP[n]),
+                         'inletT':float(nodeT[inlet]), 'outletT':float(nodeT[inlet] + self.power[n]*flowRth[i]),
+                         'flowRth':float(flowRth[i]), 'power':float(self.power[n])}
+                plate['channelPerf'] = dict((key, float(perf[key][i])) for key in mb.CHANNEL_PERF_KEYS)
+                plate['sourceT'] = plate['inletT'] + plate['power']*plate['channelPerf']['RTotal']
+                plates[loop.edges[n][0]] = plate
+        results['plates'] = plates
+        return results
@@ -0,0 +1,116 @@
+from __future__ import division
+import numpy as np
+import thermal_properties as tp
+
+
+# property tables as arrays, built once from the thermal_properties tables
+AIR_T = np.array(tp.AIR_T, dtype=float)
+AIR_RHO = np.array(tp.AIR_RHO)*1e-3
+AIR_K = np.array(tp.AIR_K)*1e-5
+AIR_CP = np.array(tp.AIR_CP)
+AIR_MU = np.array(tp.AIR_MU)*1e-11
+
+WATER_T = np.array(tp.WATER_T, dtype=float)
+WATER_RHO = np.array(tp.WATER_RHO)
+WATER_K = np.array(tp.WATER_K)*1e-5
+WATER_CP = np.array(tp.WATER_CP)
+WATER_MU = np.array(tp.WATER_MU)*1e-10
+
+EGW_T0 = tp.EGW_T[0]
+EGW_T1 = tp.EGW_T[1]
+EGW_CONC = np.array(tp.EGW_CONC, dtype=float)
+EGW_RHO = np.array(tp.EGW_RHO)
+EGW_K = np.array([tp.EGW_K0, tp.EGW_K20])*1.7296/100
+EGW_CP = np.array([tp.EGW_CP0, tp.EGW_CP20])*4.184
+EGW_MU = np.array([tp.EGW_MU0, tp.EGW_MU20])*1e-7
+EGW_FZT = np.array(tp.EGW_FZT)
+
+COOLANT_PROPERTY_KEYS = ('rho', 'k', 'cp', 'mu', 'fzT')
+
+
+def interp1d_array(x, y, xi):
+    # vectorized interp1d: linear interpolation with the end values held
+    # outside the table, the bracket is found by binary search
+    return np.interp(xi, x, y)
+
+
+def interp_egw(table, coolantT, concPercent):
+    # interpolate a two row (0 and 20 degree C) EGW table over concentration,
+    # then linearly over the clamped temperature
+    y0 = np.interp(concPercent, EGW_CONC, table[0])
+    y1 = np.interp(concPercent, EGW_CONC, table[1])
+    t = (np.clip(coolantT, EGW_T0, EGW_T1) - EGW_T0)/(EGW_T1 - EGW_T0)
+    return y0 + (y1 - y0)*t
+
+
+def calc_air_property(key, coolantT):
+    if key == 'fzT':
+        return np.full(np.shape(coolantT), -273.0)
+    table = {'rho':AIR_RHO, 'k':AIR_K, 'cp':AIR_CP, 'mu':AIR_MU}[key]
+    return interp1d_array(AIR_T, table, np.asarray(coolantT, dtype=float) + 273)
+
+
+def calc_water_property(key, coolantT):
+    if key == 'fzT':
+        return np.zeros(np.shape(coolantT))
+    table = {'rho':WATER_RHO, 'k':WATER_K, 'cp':WATER_CP, 'mu':WATER_MU}[key]
+    return interp1d_array(WATER_T, table, np.asarray(coolantT, dtype=float) + 273)
+
+
+def calc_egw_property(key, coolantT, concPercent):
+    # the concentration tables are interpolated before broadcasting against the
+    # temperatures, so e.g. conc (M, 1) with T (M, N) interpolates M points only
+    T = np.asarray(coolantT, dtype=float)
+    conc = np.asarray(concPercent, dtype=float)
+    if key in ('rho', 'fzT'):
+        table = EGW_RHO if key == 'rho' else EGW_FZT
+        shape = np.broadcast(T, conc).shape
+        return np.broadcast_to(interp1d_array(EGW_CONC, table, conc), shape)
+    table = {'k':EGW_K, 'cp':EGW_CP, 'mu':EGW_MU}[key]
+    return interp_egw(table, T, conc)
+
+
+def calc_coolant_property(name, key, coolantT, concPercent = 20):
+    # a single coolant property ('rho', 'k', 'cp', 'mu' or 'fzT') for arrays of
+    # temperatures (C) and EGW concentrations (%)
+    if name.lower() == 'air':
+        return calc_air_property(key, coolantT)
+    elif name.lower() == 'water':
+        return calc_water_property(key, coolantT)
+    elif name.lower() == 'egw':
+        return calc_egw_property(key, coolantT, concPercent)
+    else:
+        raise ValueError('unknown coolant: {0}'.format(name))
+
+
+def calc_air_properties(coolantT):
+    return dict((key, calc_air_property(key, coolantT)) for key in COOLANT_PROPERTY_KEYS)
+
+
+def calc_water_properties(coolantT):
+    return dict((key, calc_water_property(key, coolantT)) for key in COOLANT_PROPERTY_KEYS)
+
+
+def calc_egw_properties(coolantT, concPercent):
+    return dict((key, calc_egw_property(key, coolantT, concPercent)) for key in COOLANT_PROPERTY_KEYS)
+
+
+def calc_coolant_properties(name, coolantT, concPercent = 20):
+    # coolant properties for arrays of temperatures (C) and EGW concentrations (%),
+    # returned as a dict of arrays with the Coolant attribute names
+    return dict((key, calc_coolant_property(name, key, coolantT, concPercent))
+                for key in COOLANT_PROPERTY_KEYS)
+
+
+def calc_coolant_properties_mixed(names, coolantT, concPercent):
+    # coolant properties when the coolant name varies per element as well
+    names, T, conc = np.broadcast_arrays(np.char.lower(np.asarray(names).astype(str)),
+                                         np.asarray(coolantT, dtype=float),
+                                         np.asarray(concPercent, dtype=float))
+    properties = dict((key, np.full(T.shape, np.nan)) for key in COOLANT_PROPERTY_KEYS)
+    for name in np.unique(names):
+        mask = (names == name)
+        subset = calc_coolant_properties(str(name), T[mask], conc[mask])
+        for key in COOLANT_PROPERTY_KEYS:
+            properties[key][mask] = subset[key]
+    return properties
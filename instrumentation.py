@@ -0,0 +1,188 @@
+from __future__ import division
+import atexit
+import functools
+import json
+import os
+import random
+import sys
+import timeit
+import numpy as np
+import thermal_properties as tp
+import coolant_properties as cpp
+import microchannel as mc
+import microchannel_batch as mb
+
+
+INSTRUMENT_ENV_VAR = 'MICROCHANNEL_INSTRUMENT'
+MAX_SAMPLES = 10000         # durations kept per stage for the percentiles
+
+timer = timeit.default_timer
+
+
+class StageStats:
+    """Call count and timings of one instrumented stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.totalTime = 0.0        # inclusive time [s]
+        self.selfTime = 0.0         # time not spent in other instrumented stages [s]
+        self.samples = []           # reservoir of inclusive durations
+
+    def add(self, elapsed, selfElapsed):
+        self.count += 1
+        self.totalTime += elapsed
+        self.selfTime += selfElapsed
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(elapsed)
+        else:
+            n = random.randint(0, self.count - 1)
+            if n < MAX_SAMPLES:
+                self.samples[n] = elapsed
+
+    def get_summary(self):
+        summary = {'count':self.count, 'totalTime':self.totalTime, 'selfTime':self.selfTime}
+        if self.count:
+            samples = np.array(self.samples)
+            summary['meanTime'] = self.totalTime/self.count
+            summary['p50'] = float(np.percentile(samples, 50))
+            summary['p90'] = float(np.percentile(samples, 90))
+            summary['p99'] = float(np.percentile(samples, 99))
+            summary['maxTime'] = float(samples.max())
+        return summary
+
+
+_stages = {}
+_patches = []           # (owner, attribute, original) of the instrumented callables
+_childTime = []         # time spent in nested stages, one entry per active call
+_counters = {}          # cache counter sources, name -> function returning a dict
+
+
+def get_stage(name):
+    if name not in _stages:
+        _stages[name] = StageStats(name)
+    return _stages[name]
+
+
+def timed(stage, func):
+    # wrap func so every call is recorded under stage
+    stats = get_stage(stage)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _childTime.append(0.0)
+        start = timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = timer() - start
+            child = _childTime.pop()
+            if _childTime:
+                _childTime[-1] += elapsed
+            stats.add(elapsed, elapsed - child)
+    return wrapper
+
+
+def get_targets():
+    # (stage, owner, attribute) of every hot path stage
+    targets = [('Microchannel.__init__', mc.Microchannel, '__init__'),
+               ('Microchannel.calc_channel_perf', mc.Microchannel, 'calc_channel_perf'),
+               ('ThermalMaterial.__init__', tp.ThermalMaterial, '__init__'),
+               ('MaterialRegistry.load', tp.MaterialRegistry, 'load'),
+               ('MaterialRegistry._load_json', tp.MaterialRegistry, '_load_json'),
+               ('MaterialRegistry._load_cached', tp.MaterialRegistry, '_load_cached'),
+               ('get_material_list', tp, 'get_material_list'),
+               ('Coolant.__init__', tp.Coolant, '__init__'),
+               ('Coolant.calc_flow_rth', tp.Coolant, 'calc_flow_rth'),
+               ('get_coolant_state', tp, 'get_coolant_state'),
+               ('interp1d', tp, 'interp1d')]
+    for name in sorted(vars(tp)):
+        if name.startswith(('get_air_', 'get_water_', 'get_egw_')):
+            targets.append((name, tp, name))
+    targets.append(('calc_channel_perf_batch', mb, 'calc_channel_perf_batch'))
+    targets.append(('calc_coolant_properties', cpp, 'calc_coolant_properties'))
+    return targets
+
+
+def enable():
+    # patch the hot path callables with timing wrappers, nothing is patched while disabled
+    if _patches:
+        return
+    for stage, owner, attribute in get_targets():
+        original = vars(owner)[attribute]
+        _patches.append((owner, attribute, original))
+        setattr(owner, attribute, timed(stage, original))
+
+
+def disable():
+    while _patches:
+        owner, attribute, original = _patches.pop()
+        setattr(owner, attribute, original)
+
+
+def is_enabled():
+    return bool(_patches)
+
+
+def reset():
+    _stages.clear()
+
+
+def register_counters(name, func):
+    # func() returns a dict of counters (e.g. cache hits/misses) reported under name
+    _counters[name] = func
+
+
+register_counters('materialRegistry', lambda: dict(tp.get_material_registry().stats))
+register_counters('coolantStates', lambda: dict(tp.coolantStateStats))
+
+
+def get_stats():
+    stats = {}
+    stats['stages'] = dict((name, _stages[name].get_summary()) for name in _stages)
+    stats['counters'] = dict((name, _counters[name]()) for name in _counters)
+    return stats
+
+
+def format_stats(stats = None):
+    if stats == None:
+        stats = get_stats()
+    lines = ['{0:<34} {1:>9} {2:>11} {3:>11} {4:>10} {5:>10} {6:>10}'.format(
+        'stage', 'calls', 'total (ms)', 'self (ms)', 'p50 (us)', 'p90 (us)', 'p99 (us)')]
+    stages = stats['stages']
+    for name in sorted(stages, key=lambda name: -stages[name]['totalTime']):
+        s = stages[name]
+        if s['count'] == 0:
+            continue
+        lines.append('{0:<34} {1:>9} {2:>11.3f} {3:>11.3f} {4:>10.2f} {5:>10.2f} {6:>10.2f}'.format(
+            name, s['count'], s['totalTime']*1e3, s['selfTime']*1e3, s['p50']*1e6, s['p90']*1e6, s['p99']*1e6))
+    for name in sorted(stats['counters']):
+        counters = stats['counters'][name]
+        lines.append('{0}: {1}'.format(name, ', '.join(
+            '{0}={1}'.format(key, counters[key]) for key in sorted(counters))))
+    return '\n'.join(lines)
+
+
+def dump(destination):
+    # destination is 'text' or 'json' for stderr, or 'text:<file>' / 'json:<file>'
+    fileFormat, _, fileName = destination.partition(':')
+    if fileFormat == 'json':
+        text = json.dumps(get_stats(), indent=2, sort_keys=True)
+    else:
+        text = format_stats()
+    if fileName:
+        with open(fileName, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stderr.write(text + '\n')
+
+
+def enable_from_environment():
+    # MICROCHANNEL_INSTRUMENT=text|json[:file] enables instrumentation and dumps it at exit
+    destination = os.environ.get(INSTRUMENT_ENV_VAR)
+    if not destination or is_enabled():
+        return
+    if destination.partition(':')[0] not in ('text', 'json'):
+        destination = 'text'
+    enable()
+    atexit.register(dump, destination)
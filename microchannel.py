@@ -1,98 +1,87 @@
 from thermal_properties import ThermalMaterial
 from thermal_properties import Coolant
 import math
+import os
 
-class Microchannel:
+
+MODEL_VERSION = '1'        # bump when the calc_channel_perf equations change
+
+
+# named designs, microchannelProperties keyed by lower case name
+MICROCHANNEL_PRESETS = {
+    'lslaserbackplane': {
+        'channelWidth':0.305,       # channel width [mm]
+        'channelHeight':2.032,      # channel height [mm]
+        'channelLength':4.1,        # channel length [cm]
+        'baseThickness':0.5,        # base thickness [mm]
+        'wallThickness':0.305,      # wall thickness [mm]
+        'numSplits':2,              # number of splits
+        'numChannelsPerSplit':24,   # number of channels per split
+        'sourceWidth':3.0,          # heat source width [cm]
+        'sourceArea':15.0,          # heat source area[cm2]
+        'flowMode':'constFlow',     # flow mode control, constant flow rate or pressure
+        'flowRate':1000,            # flow rate for constant flow mode [ccm]
+        'pressure':0.8,             # pressure drop for constant pressure mode [psi]
+        'headloss':10,              # headloss number
+        'nuInf':6,                  # fully developed Nusselt number
+        'thermalMaterialName':'Cu',
+        'coolantName':'EGW', 'coolantT':20, 'concPercent':20},
+    'lstecoldplate': {
+        'channelWidth':0.432, 'channelHeight':0.508, 'channelLength':3.025,
+        'baseThickness':0.5, 'wallThickness':0.432, 'numSplits':4, 'numChannelsPerSplit':25,
+        'sourceWidth':2.5, 'sourceArea':25.0, 'flowMode':'constFlow', 'flowRate':150,
+        'pressure':0.3, 'headloss':6, 'nuInf':6, 'thermalMaterialName':'Cu',
+        'coolantName':'EGW', 'coolantT':5, 'concPercent':20},
+    'lstehotplate': {
+        'channelWidth':0.305, 'channelHeight':1.778, 'channelLength':2.469,
+        'baseThickness':0.5, 'wallThickness':0.305, 'numSplits':2, 'numChannelsPerSplit':25,
+        'sourceWidth':2.5, 'sourceArea':12.5, 'flowMode':'constFlow', 'flowRate':1000,
+        'pressure':0.6, 'headloss':5, 'nuInf':6, 'thermalMaterialName':'Cu',
+        'coolantName':'EGW', 'coolantT':20, 'concPercent':20},
+    'lsepitip': {
+        'channelWidth':0.254, 'channelHeight':1.778, 'channelLength':4.801,
+        'baseThickness':0.254, 'wallThickness':0.254, 'numSplits':1, 'numChannelsPerSplit':8,
+        'sourceWidth':0.4, 'sourceArea':1.92, 'flowMode':'constFlow', 'flowRate':150,
+        'pressure':2.0, 'headloss':10, 'nuInf':6, 'thermalMaterialName':'Cu',
+        'coolantName':'EGW', 'coolantT':5, 'concPercent':20},
+}
+PRESET_NAMES = ('LSLaserBackplane', 'LSTEColdPlate', 'LSTEHotPlate', 'LSEpiTip')
+
+
+def get_preset_properties(name):
+    # microchannelProperties of a named preset (case-insensitive), None if unknown
+    properties = MICROCHANNEL_PRESETS.get(name.lower())
+    return dict(properties) if properties != None else None
+
+
+class Microchannel(object):
     """Microchannel class with properties"""
+
+    __slots__ = ('name', 'channelWidth', 'channelHeight', 'channelLength', 'baseThickness',
+                 'wallThickness', 'numSplits', 'numChannelsPerSplit', 'sourceWidth', 'sourceArea',
+                 'flowMode', 'flowRate', 'pressure', 'headloss', 'nuInf', 'thermalMaterial', 'coolant')
     
     def __init__(self, name, microchannelProperties = None):
         self.name = name
         if microchannelProperties == None:
-            if name.lower() == ('LSLaserBackplane').lower():
-                self.channelWidth = 0.305       # channel width [mm]
-                self.channelHeight = 2.032      # channel height [mm]
-                self.channelLength = 4.1        # channel length [cm]
-                self.baseThickness = 0.5        # base thickness [mm]
-                self.wallThickness = 0.305      # wall thickness [mm]
-                self.numSplits = 2              # number of splits
-                self.numChannelsPerSplit = 24   # number of channels per split
-                self.sourceWidth = 3.0          # heat source width [cm]
-                self.sourceArea = 15.0          # heat source area[cm2]
-                self.flowMode = 'constFlow'     # flow mode control, constant flow rate or pressure
-                self.flowRate = 1000            # flow rate for constant flow mode [ccm]
-                self.pressure = 0.8             # pressure drop for constant pressure mode [psi]
-                self.headloss = 10              # headloss number
-                self.nuInf = 6                  # fully developed Nusselt number
-                self.thermalMaterial = ThermalMaterial('Cu')
-                self.coolant = Coolant('EGW', {'coolantT':20, 'flowRate':1000, 'concPercent':20})
-            elif name.lower() == ('LSTEColdPlate').lower():
-                self.channelWidth = 0.432
-                self.channelHeight = 0.508
-                self.channelLength = 3.025
-                self.baseThickness = 0.5
-                self.wallThickness = 0.432
-                self.numSplits = 4
-                self.numChannelsPerSplit = 25
-                self.sourceWidth = 2.5
-                self.sourceArea = 25.0
-                self.flowMode = 'constFlow'
-                self.flowRate = 150
-                self.pressure = 0.3
-                self.headloss = 6
-                self.nuInf = 6
-                self.thermalMaterial = ThermalMaterial('Cu')
-                self.coolant = Coolant('EGW', {'coolantT':5, 'flowRate':150, 'concPercent':20})
-            elif name.lower() == ('LSTEHotPlate').lower():
-                self.channelWidth = 0.305
-                self.channelHeight = 1.778
-                self.channelLength = 2.469
-                self.baseThickness = 0.5
-                self.wallThickness = 0.305
-                self.numSplits = 2
-                self.numChannelsPerSplit = 25
-                self.sourceWidth = 2.5
-                self.sourceArea = 12.5
-                self.flowMode = 'constFlow'
-                self.flowRate = 1000
-                self.pressure = 0.6
-                self.headloss = 5
-                self.nuInf = 6
-                self.thermalMaterial = ThermalMaterial('Cu')
-                self.coolant = Coolant('EGW', {'coolantT':20, 'flowRate':1000, 'concPercent':20})
-            elif name.lower() == ('LSEpiTip').lower():
-                self.channelWidth = 0.254
-                self.channelHeight = 1.778
-                self.channelLength = 4.801
-                self.baseThickness = 0.254
-                self.wallThickness = 0.254
-                self.numSplits = 1
-                self.numChannelsPerSplit = 8
-                self.sourceWidth = 0.4
-                self.sourceArea = 1.92
-                self.flowMode = 'constFlow'
-                self.flowRate = 150
-                self.pressure = 2.0
-                self.headloss = 10
-                self.nuInf = 6
-                self.thermalMaterial = ThermalMaterial('Cu')
-                self.coolant = Coolant('EGW', {'coolantT':5, 'flowRate':150, 'concPercent':20})
-            else:
-                self.channelWidth = None
-                self.channelHeight = None
-                self.channelLength = None
-                self.baseThickness = None
-                self.wallThickness = None
-                self.numSplits = None
-                self.numChannelsPerSplit = None
-                self.sourceWidth = None
-                self.sourceArea = None
-                self.flowMode = None
-                self.flowRate = None
-                self.pressure = None
-                self.headloss = None
-                self.nuInf = None
-                self.thermalMaterial = None
-                self.coolant = None
+            microchannelProperties = MICROCHANNEL_PRESETS.get(name.lower())
+        if microchannelProperties == None:
+            self.channelWidth = None
+            self.channelHeight = None
+            self.channelLength = None
+            self.baseThickness = None
+            self.wallThickness = None
+            self.numSplits = None
+            self.numChannelsPerSplit = None
+            self.sourceWidth = None
+            self.sourceArea = None
+            self.flowMode = None
+            self.flowRate = None
+            self.pressure = None
+            self.headloss = None
+            self.nuInf = None
+            self.thermalMaterial = None
+            self.coolant = None
         else:
             self.channelWidth = microchannelProperties['channelWidth']
             self.channelHeight = microchannelProperties['channelHeight']
@@ -198,7 +187,36 @@ class Microchannel:
         channelPerf['Re'] = Re
         channelPerf['NuAvg'] = NuAvg
         channelPerf['xCrit'] = xCrit
+        channelPerf['zcOpt'] = zcOpt
+        channelPerf['wcOpt0'] = wcOpt0
 
         return channelPerf
 
+    def get_properties(self):
+        # microchannelProperties dict that rebuilds this model
+        microchannelProperties = {}
+        microchannelProperties['channelWidth'] = self.channelWidth
+        microchannelProperties['channelHeight'] = self.channelHeight
+        microchannelProperties['channelLength'] = self.channelLength
+        microchannelProperties['baseThickness'] = self.baseThickness
+        microchannelProperties['wallThickness'] = self.wallThickness
+        microchannelProperties['numSplits'] = self.numSplits
+        microchannelProperties['numChannelsPerSplit'] = self.numChannelsPerSplit
+        microchannelProperties['sourceWidth'] = self.sourceWidth
+        microchannelProperties['sourceArea'] = self.sourceArea
+        microchannelProperties['flowMode'] = self.flowMode
+        microchannelProperties['flowRate'] = self.flowRate
+        microchannelProperties['pressure'] = self.pressure
+        microchannelProperties['headloss'] = self.headloss
+        microchannelProperties['nuInf'] = self.nuInf
+        microchannelProperties['thermalMaterialName'] = self.thermalMaterial.name
+        microchannelProperties['coolantName'] = self.coolant.name
+        microchannelProperties['coolantT'] = self.coolant.coolantT
+        microchannelProperties['concPercent'] = getattr(self.coolant, 'concPercent', None)
+        return microchannelProperties
+
 
+if os.environ.get('MICROCHANNEL_INSTRUMENT'):
+    # opt-in stage timing, see instrumentation.enable_from_environment
+    import instrumentation
+    instrumentation.enable_from_environment()
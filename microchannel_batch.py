@@ -0,0 +1,163 @@
+from __future__ import division
+import sys
+import numpy as np
+
+
+BATCH_INPUT_KEYS = ('channelWidth', 'channelHeight', 'channelLength', 'baseThickness', 'wallThickness',
+                    'numSplits', 'numChannelsPerSplit', 'sourceWidth', 'sourceArea', 'flowMode',
+                    'flowRate', 'pressure', 'headloss', 'nuInf', 'wallK', 'coolantK', 'coolantMu',
+                    'coolantRho', 'coolantCp')
+CHANNEL_PERF_KEYS = ('RConv', 'RHeat', 'RCond', 'RTotal', 'alpha', 'finEta',
+                     'v', 'P', 'f', 'Re', 'NuAvg', 'xCrit', 'zcOpt', 'wcOpt0')
+
+
+def get_const_pressure_mask(flowMode):
+    # flow mode strings ('constFlow' or 'constPressure') to a boolean mask with
+    # the comparison of Microchannel.calc_channel_perf, the lower case mode
+    # against 'constPressure'; a boolean array is taken as the mask itself
+    fMode = np.asarray(flowMode)
+    if fMode.dtype == bool:
+        return fMode
+    fMode = np.char.lower(fMode.astype(str))
+    return fMode == ('constPressure')
+
+
+def is_integer(x):
+    return isinstance(x, int) or (isinstance(x, (np.ndarray, np.generic)) and x.dtype.kind in 'iu')
+
+
+def classic_div(a, b):
+    # a/b the way the scalar model evaluates it; microchannel.py has no division
+    # import, so under Python 2 two integer operands floor
+    if sys.version_info[0] < 3 and is_integer(a) and is_integer(b):
+        return a//b
+    return a/b
+
+
+def calc_channel_perf_batch(channelWidth, channelHeight, channelLength, baseThickness,
+                            wallThickness, numSplits, numChannelsPerSplit, sourceWidth,
+                            sourceArea, flowMode, flowRate, pressure, headloss, nuInf,
+                            wallK, coolantK, coolantMu, coolantRho, coolantCp):
+    # Vectorized counterpart of Microchannel.calc_channel_perf. Every argument is a
+    # scalar or an array, all arguments are broadcast against each other and the
+    # results are returned as a dict of arrays with the channelPerf keys.
+    # The equations are kept term by term identical to the scalar model so both
+    # paths agree to floating-point tolerance; the constant flow and constant
+    # pressure branches are selected per element with masks.
+    isConstP = get_const_pressure_mask(flowMode)
+    (wc, zc, Lc, zb, ww, nsp, nc, ws, As, f, P, Ph, NuInf, kw, kf, mu, rho, cp,
+        isConstP) = np.broadcast_arrays(
+            np.asarray(channelWidth), np.asarray(channelHeight), np.asarray(channelLength),
+            np.asarray(baseThickness), np.asarray(wallThickness), np.asarray(numSplits),
+            np.asarray(numChannelsPerSplit), np.asarray(sourceWidth)*10, np.asarray(sourceArea),
+            np.asarray(flowRate), np.asarray(pressure), np.asarray(headloss), np.asarray(nuInf),
+            np.asarray(wallK), np.asarray(coolantK), np.asarray(coolantMu),
+            np.asarray(coolantRho), np.asarray(coolantCp), isConstP)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return calc_channel_perf_equations(wc, zc, Lc, zb, ww, nsp, nc, ws, As, f, P, Ph, NuInf,
+                                           kw, kf, mu, rho, cp, isConstP)
+
+
+def calc_channel_perf_equations(wc, zc, Lc, zb, ww, nsp, nc, ws, As, f, P, Ph, NuInf, kw, kf,
+                                mu, rho, cp, isConstP, xp = np):
+    # The calc_channel_perf equations on broadcast arrays. xp supplies exp, tanh and
+    # where, so the same equations run on numpy arrays or on other array types
+    # such as the dual numbers of microchannel_sensitivity.
+    #Calculate flow parameters
+    Pr = (mu*1e4)*(cp*1e3)/(kf*1e2)		# Prandtl number
+    D = classic_div(4*wc*zc, 2*(zc + wc))			# channel characteristic width [mm]
+
+    B = (np.pi*(D**2)/4)/(wc*zc)		# cross section shape factor for calculating pressure drop
+    C = 16*xp.exp(0.294*(B**2) + 0.068*B - 0.318)      # fRe, C factor in calculating pressure drop
+    c1 = Ph*(rho*1e3)/2		# coefficient due to pressure head loss
+    c2 = (2*C*(mu*1e4)*(Lc*1e-3))/((D*1e-3)**2)		# coefficient due to laminar flow pressure
+    flowArea = nsp*nc*wc*zc*1e-2        # total flow cross section [cm2]
+
+    # constant pressure case, the c1 == 0 elements reduce to pure laminar flow; the
+    # first order c1 term is exactly zero there but keeps d(v)/d(c1) right for
+    # the derivatives of microchannel_sensitivity. As in the scalar model the
+    # flow rate is only recomputed in the c1 != 0 branch.
+    isLaminar = (c1 == 0)
+    vConstP = xp.where(isLaminar, 1e2*((P/1.4504e-4)/c2)*(1 - c1*(P/1.4504e-4)/(c2**2)),
+                       1e2*((-c2 + (c2**2 + 4*c1*(P/1.4504e-4))**0.5)/(2*xp.where(isLaminar, 1, c1))))
+    fConstP = 60*vConstP*flowArea
+    isFlowSolved = isConstP & ~isLaminar
+
+    # constant flow rate case
+    vConstF = classic_div(f, 60)/flowArea
+    PConstF = 1.4504e-4*(c1*(vConstF*1e-2)**2 + c2*(vConstF*1e-2))
+
+    v = xp.where(isConstP, vConstP, vConstF)     # mean flow velocity [cm/s]
+    P = xp.where(isConstP, P, PConstF)          # pressure drop [psi]
+    fPerSecond = xp.where(isFlowSolved, fConstP/60, classic_div(f, 60))
+    f = xp.where(isFlowSolved, fConstP, f)          # flow rate [ccm]
+
+    Re = (v*1e-2)*(D*1e-3)*(rho*1e3)/(mu*1e4)		# Reynolds number
+    alpha = nsp*nc*(2*zc + wc)*Lc/(As*1e2)			# surface area multiplication factor
+
+    DRePr = D*Re*Pr		# D*Re*Pr product [mm]
+    NuAvg = NuInf + ((0.0668*DRePr/Lc)/(1 + 0.04*(DRePr/Lc)**classic_div(2, 3)))		# average Nusselt number
+    xCrit = 0.02*DRePr		# critical length for fully developed flow [mm]
+
+    h = NuAvg*kf/(D*1e-1)		# convective heat transfer coefficient [W/C-cm^2]
+    finN = (zc*1e-1)*(2*h/(kw*(ww*1e-1)))**0.5		# factor for calculating fin efficiency
+    finEta = 100*xp.tanh(finN)/finN		# fin efficiency [%]
+
+    RConv = 1/(h*alpha*As)			# thermal resistance due to convection [C/W]
+    RHeat = 1/(2*rho*cp*fPerSecond)		# thermal resistance due to fluid heating [C/W]
+    RCond = (zb*1e-1)/(kw*As)		# thermal resistance due to source base conduction [C/W]
+    RTotal = RConv + RHeat + RCond		# total thermal resistance [C/W]
+
+    zcOpt = 10*(1/(2*h/(kw*(ww*1e-1)))**0.5)	# optimum channel height [mm]
+    #guessed optimum channel width [mm]
+    wcOpt0 = 1e3*2.29*((mu*1e4)*(kf*1e2)*((Lc*1e-3)**2)*NuAvg/((rho*1e3)*(cp*1e3)*(P/1.4504e-4)))**classic_div(1, 4)
+
+    # Load the calculation results
+    channelPerf = {}
+    channelPerf['RConv'] = RConv
+    channelPerf['RHeat'] = RHeat
+    channelPerf['RCond'] = RCond
+    channelPerf['RTotal'] = RTotal
+    channelPerf['alpha'] = alpha
+    channelPerf['finEta'] = finEta
+    channelPerf['v'] = v
+    channelPerf['P'] = P
+    channelPerf['f'] = f
+    channelPerf['Re'] = Re
+    channelPerf['NuAvg'] = NuAvg
+    channelPerf['xCrit'] = xCrit
+    channelPerf['zcOpt'] = zcOpt
+    channelPerf['wcOpt0'] = wcOpt0
+
+    return channelPerf
+
+
+def get_batch_columns(models):
+    # collect the calc_channel_perf_batch arguments from a list of Microchannel objects
+    columns = {}
+    columns['channelWidth'] = np.array([m.channelWidth for m in models])
+    columns['channelHeight'] = np.array([m.channelHeight for m in models])
+    columns['channelLength'] = np.array([m.channelLength for m in models])
+    columns['baseThickness'] = np.array([m.baseThickness for m in models])
+    columns['wallThickness'] = np.array([m.wallThickness for m in models])
+    columns['numSplits'] = np.array([m.numSplits for m in models])
+    columns['numChannelsPerSplit'] = np.array([m.numChannelsPerSplit for m in models])
+    columns['sourceWidth'] = np.array([m.sourceWidth for m in models])
+    columns['sourceArea'] = np.array([m.sourceArea for m in models])
+    columns['flowMode'] = np.array([m.flowMode for m in models])
+    columns['flowRate'] = np.array([m.flowRate for m in models])
+    columns['pressure'] = np.array([m.pressure for m in models])
+    columns['headloss'] = np.array([m.headloss for m in models])
+    columns['nuInf'] = np.array([m.nuInf for m in models])
+    columns['wallK'] = np.array([m.thermalMaterial.k for m in models])
+    columns['coolantK'] = np.array([m.coolant.k for m in models])
+    columns['coolantMu'] = np.array([m.coolant.mu for m in models])
+    columns['coolantRho'] = np.array([m.coolant.rho for m in models])
+    columns['coolantCp'] = np.array([m.coolant.cp for m in models])
+    return columns
+
+
+def calc_microchannel_perf_batch(models):
+    # evaluate a list of Microchannel objects in one vectorized call
+    return calc_channel_perf_batch(**get_batch_columns(models))
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+from __future__ import division
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import numpy as np
+import microchannel as mc
+import microchannel_batch as mb
+import microchannel_designs as md
+import coolant_properties as cpp
+import thermal_properties as tp
+
+
+BATCH_SIZES = (1, 10, 100, 1000, 10000, 100000, 1000000)
+BENCHMARK_BASELINE_FILE_NAME = 'benchmark_baseline.json'
+
+
+def measure(func, items = 1, minSampleTime = 0.005, numSamples = 15):
+    # time func in samples of `number` calls each, sized so one sample takes at least
+    # minSampleTime; latencies are per call [s], throughput is items per second.
+    # Each sample is the mean call time over the sample, so sampleMedian and sampleP90
+    # are quantiles of sample means, not of single calls.
+    number = 1
+    while True:
+        elapsed = timeit.timeit(func, number = number)
+        if elapsed >= minSampleTime or number >= 1000000:
+            break
+        number *= 10 if elapsed < minSampleTime/10 else 2
+
+    gcEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        samples = np.array(timeit.repeat(func, number = number, repeat = numSamples))/number
+    finally:
+        if gcEnabled:
+            gc.enable()
+
+    result = {}
+    result['items'] = items
+    result['callsPerSample'] = number
+    result['samples'] = numSamples
+    result['mean'] = float(samples.mean())
+    result['min'] = float(samples.min())
+    result['sampleMedian'] = float(np.percentile(samples, 50))
+    result['sampleP90'] = float(np.percentile(samples, 90))
+    result['throughput'] = items/result['sampleMedian']
+    return result
+
+
+def get_model_benchmark(flowMode):
+    model = mc.Microchannel('LSLaserBackplane')
+    model.flowMode = flowMode
+    return model.calc_channel_perf
+
+
+def get_batch_benchmark(n):
+    columns = mb.get_batch_columns([mc.Microchannel(name) for name in mc.PRESET_NAMES])
+    index = np.arange(n) % len(mc.PRESET_NAMES)
+    batch = dict((key, columns[key][index]) for key in columns)
+    batch['channelWidth'] = batch['channelWidth']*np.linspace(0.8, 1.2, n)
+    return lambda: mb.calc_channel_perf_batch(**batch)
+
+
+def get_coolant_benchmark(n):
+    coolantT = np.linspace(0, 40, n)
+    concPercent = np.linspace(10, 50, n)
+    return lambda: cpp.calc_coolant_properties('egw', coolantT, concPercent)
+
+
+def get_designs_benchmark(numFlowRates):
+    designs = md.DesignSet.from_presets(mc.PRESET_NAMES, flowRate=np.linspace(50, 1000, numFlowRates))
+    return designs.evaluate
+
+
+def get_benchmarks(maxBatchSize = 1000000):
+    # (name, setup, items) for every hot path; setup() builds the inputs and returns
+    # the function to time, so only the benchmarks that are run build their inputs
+    benchmarks = []
+    for name in mc.PRESET_NAMES:
+        benchmarks.append(('Microchannel.__init__[{0}]'.format(name),
+                           lambda name = name: lambda: mc.Microchannel(name), 1))
+
+    for flowMode in ('constFlow', 'constPressure'):
+        benchmarks.append(('calc_channel_perf[{0}]'.format(flowMode),
+                           lambda flowMode = flowMode: get_model_benchmark(flowMode), 1))
+
+    for name in ('air', 'water', 'egw'):
+        properties = {'coolantT':20, 'flowRate':1000, 'concPercent':20}
+        benchmarks.append(('Coolant.__init__[{0}]'.format(name),
+                           lambda name = name: lambda: tp.Coolant(name, properties), 1))
+        benchmarks.append(('Coolant.__init__[{0},uncached]'.format(name),
+                           lambda name = name: lambda:
+                               (tp.clear_coolant_states(), tp.Coolant(name, properties)), 1))
+
+    benchmarks.append(('ThermalMaterial.__init__', lambda: lambda: tp.ThermalMaterial('Cu'), 1))
+    benchmarks.append(('get_material_list', lambda: tp.get_material_list, 1))
+    benchmarks.append(('interp1d', lambda: lambda: tp.interp1d(tp.WATER_T, tp.WATER_MU, 296.3), 1))
+
+    # scaling of the batched paths
+    for n in BATCH_SIZES:
+        if n > maxBatchSize:
+            break
+        benchmarks.append(('calc_channel_perf_batch[n={0}]'.format(n),
+                           lambda n = n: get_batch_benchmark(n), n))
+        benchmarks.append(('calc_coolant_properties[egw,n={0}]'.format(n),
+                           lambda n = n: get_coolant_benchmark(n), n))
+        numFlowRates = -(-n//len(mc.PRESET_NAMES))
+        numDesigns = numFlowRates*len(mc.PRESET_NAMES)
+        benchmarks.append(('DesignSet.evaluate[n={0}]'.format(numDesigns),
+                           lambda numFlowRates = numFlowRates: get_designs_benchmark(numFlowRates),
+                           numDesigns))
+    return benchmarks
+
+
+def run_benchmarks(nameFilter = None, maxBatchSize = 1000000, minSampleTime = 0.005, numSamples = 15):
+    report = {}
+    report['meta'] = {'python':platform.python_version(), 'numpy':np.__version__,
+                      'platform':platform.platform(), 'machine':platform.machine(),
+                      'time':time.strftime('%Y-%m-%dT%H:%M:%S')}
+    report['results'] = {}
+    for name, setup, items in get_benchmarks(maxBatchSize):
+        if nameFilter and nameFilter not in name:
+            continue
+        report['results'][name] = measure(setup(), items, minSampleTime, numSamples)
+    return report
+
+
+def compare_to_baseline(report, baseline, threshold = 0.25):
+    # relative slowdown of the median sample latency for every benchmark in both
+    # reports, returns (comparisons, regressions)
+    comparisons = {}
+    regressions = []
+    for name in sorted(report['results']):
+        if name not in baseline['results']:
+            continue
+        ratio = report['results'][name]['sampleMedian']/baseline['results'][name]['sampleMedian']
+        comparisons[name] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return comparisons, regressions
+
+
+def format_report(report, comparisons = None):
+    lines = ['{0:<45} {1:>11} {2:>11} {3:>11} {4:>14} {5:>8}'.format(
+        'benchmark', 'min (us)', 'median (us)', 'p90 (us)', 'items/s', 'vs base')]
+    for name in sorted(report['results']):
+        r = report['results'][name]
+        ratio = '' if not comparisons or name not in comparisons else '{0:.2f}x'.format(comparisons[name])
+        lines.append('{0:<45} {1:>11.3f} {2:>11.3f} {3:>11.3f} {4:>14.4g} {5:>8}'.format(
+            name, r['min']*1e6, r['sampleMedian']*1e6, r['sampleP90']*1e6, r['throughput'], ratio))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    """ Benchmarks of the model hot paths
+            Writes per benchmark latencies (seconds per call, the min, median and 90th
+            percentile of the timing sample means) and throughput (designs or calls per
+            second) as JSON, and compares the median to a stored baseline. Any benchmark slower than the baseline by more than the
+            threshold fails the run with exit status 1.
+        Run command examples:
+            ./microchannel_benchmark.py -o benchmark_baseline.json
+            ./microchannel_benchmark.py -o bench.json --baseline benchmark_baseline.json --threshold 0.25
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the microchannel model hot paths')
+    parser.add_argument('-o', '--output', default=None, help='JSON report file')
+    parser.add_argument('--baseline', default=None,
+                        help='baseline JSON report, defaults to ' + BENCHMARK_BASELINE_FILE_NAME + ' if present')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--filter', default=None, help='only run benchmarks whose name contains this')
+    parser.add_argument('--max-batch', type=int, default=1000000, help='largest batch size')
+    parser.add_argument('--samples', type=int, default=15, help='timing samples per benchmark')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.filter, args.max_batch, numSamples = args.samples)
+
+    baselineFileName = args.baseline
+    if baselineFileName == None and os.path.exists(BENCHMARK_BASELINE_FILE_NAME) and \
+            os.path.abspath(BENCHMARK_BASELINE_FILE_NAME) != os.path.abspath(args.output or ''):
+        baselineFileName = BENCHMARK_BASELINE_FILE_NAME
+    comparisons = None
+    regressions = []
+    if baselineFileName != None:
+        with open(baselineFileName, 'r') as f:
+            baseline = json.load(f)
+        comparisons, regressions = compare_to_baseline(report, baseline, args.threshold)
+        report['baseline'] = {'file':baselineFileName, 'threshold':args.threshold,
+                              'ratios':comparisons, 'regressions':regressions}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    sys.stdout.write(format_report(report, comparisons) + '\n')
+    if regressions:
+        sys.stderr.write('REGRESSION: {0} benchmark(s) slower than baseline by more than {1:.0%}:\n'.format(
+            len(regressions), args.threshold))
+        for name in regressions:
+            sys.stderr.write('  {0}: {1:.2f}x\n'.format(name, comparisons[name]))
+        sys.exit(1)
@@ -0,0 +1,276 @@
+from __future__ import division
+import csv
+import numpy as np
+import microchannel as mc
+import microchannel_batch as mb
+import coolant_properties as cpp
+import thermal_properties as tp
+
+
+# microchannelProperties fields, the text fields are stored as codes into a list of levels
+DESIGN_KEYS = ('channelWidth', 'channelHeight', 'channelLength', 'baseThickness', 'wallThickness',
+               'numSplits', 'numChannelsPerSplit', 'sourceWidth', 'sourceArea', 'flowMode',
+               'flowRate', 'pressure', 'headloss', 'nuInf', 'thermalMaterialName', 'coolantName',
+               'coolantT', 'concPercent')
+DESIGN_TEXT_KEYS = ('flowMode', 'thermalMaterialName', 'coolantName')
+EVALUATE_CHUNK_SIZE = 65536     # designs per calc_channel_perf_batch call, bounds the temporaries
+
+
+def encode_text(values):
+    # (codes, levels) of a text column, levels in order of first appearance
+    values = np.asarray(values)
+    if values.ndim == 0:
+        return np.zeros(1, dtype=np.uint8), [str(values)]
+    levels, first, codes = np.unique(values.astype(str), return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    remap = np.empty(len(order), dtype=np.intp)
+    remap[order] = np.arange(len(order))
+    codes = remap[codes.ravel()].reshape(values.shape)
+    return codes.astype(np.min_scalar_type(len(levels))), [str(levels[n]) for n in order]
+
+
+def get_footprint(channelWidth, wallThickness, numChannelsPerSplit, numSplits = 1):
+    # width taken across the source by numSplits splits side by side [mm], the
+    # channels of a split separated by walls
+    return numSplits*(numChannelsPerSplit*channelWidth + (numChannelsPerSplit - 1)*wallThickness)
+
+
+class ColumnSet(object):
+    """Equal length named columns, the storage of DesignSet and ChannelPerfSet"""
+
+    __slots__ = ('columns', 'levels')
+    keys = ()
+
+    def __init__(self, columns, levels = None):
+        # columns is a dict of arrays (broadcast against each other); text columns are
+        # either given as strings or as integer codes with their levels
+        self.levels = dict(levels or {})
+        arrays = []
+        for key in self.keys:
+            if key in self.levels:
+                arrays.append(np.asarray(columns[key]))
+            elif key in DESIGN_TEXT_KEYS:
+                codes, self.levels[key] = encode_text(columns[key])
+                arrays.append(codes if np.ndim(columns[key]) else codes[0])
+            else:
+                arrays.append(np.asarray(columns[key], dtype=float))
+        arrays = np.broadcast_arrays(*[np.atleast_1d(a) for a in arrays])
+        self.columns = dict((key, np.ascontiguousarray(a.ravel())) for key, a in zip(self.keys, arrays))
+
+    def __len__(self):
+        return len(self.columns[self.keys[0]])
+
+    def __getitem__(self, index):
+        # a column by name, one record by position, or a subset by slice, mask or index array
+        if isinstance(index, (str, type(u''))):
+            return self.get_column(index)
+        if isinstance(index, (int, np.integer)):
+            return self.get_record(index)
+        return self.take(index)
+
+    def get_column(self, key):
+        # column values, text columns decoded to an array of strings
+        if key in self.levels:
+            return np.array(self.levels[key])[self.columns[key]]
+        return self.columns[key]
+
+    def get_record(self, n):
+        record = {}
+        for key in self.keys:
+            value = self.columns[key][n]
+            record[key] = self.levels[key][value] if key in self.levels else float(value)
+        return record
+
+    def iter_records(self):
+        for n in range(len(self)):
+            yield self.get_record(n)
+
+    def take(self, index):
+        # subset of the rows, index is a slice, a boolean mask or an index array
+        subset = object.__new__(type(self))
+        subset.levels = dict(self.levels)
+        subset.columns = dict((key, self.columns[key][index]) for key in self.keys)
+        return subset
+
+    def filter(self, mask):
+        return self.take(np.asarray(mask, dtype=bool))
+
+    def to_records(self):
+        # numpy structured array with one compact record per row
+        dtype = [(key, 'U{0}'.format(max([1] + [len(level) for level in self.levels[key]])) if key in self.levels
+                  else np.float64) for key in self.keys]
+        records = np.empty(len(self), dtype=dtype)
+        for key in self.keys:
+            records[key] = self.get_column(key)
+        return records
+
+    def save(self, fileName):
+        # npz file with the raw columns and the text levels
+        arrays = dict(self.columns)
+        for key in self.levels:
+            arrays['levels:' + key] = np.array(self.levels[key])
+        np.savez(fileName, **arrays)
+
+    @classmethod
+    def load(cls, fileName):
+        with np.load(fileName) as data:
+            columns = dict((key, data[key]) for key in cls.keys)
+            levels = dict((key, [str(level) for level in data['levels:' + key]])
+                          for key in cls.keys if 'levels:' + key in data.files)
+        return cls(columns, levels)
+
+    @classmethod
+    def concatenate(cls, sets):
+        # one set from several, the text levels are merged
+        columns = {}
+        levels = {}
+        for key in cls.keys:
+            if key in DESIGN_TEXT_KEYS:
+                levels[key] = []
+                parts = []
+                for s in sets:
+                    for level in s.levels[key]:
+                        if level not in levels[key]:
+                            levels[key].append(level)
+                    remap = np.array([levels[key].index(level) for level in s.levels[key]], dtype=np.intp)
+                    parts.append(remap[s.columns[key]] if len(remap) else s.columns[key])
+                columns[key] = np.concatenate(parts).astype(np.min_scalar_type(len(levels[key])))
+            else:
+                columns[key] = np.concatenate([s.columns[key] for s in sets])
+        return cls(columns, levels)
+
+
+class DesignSet(ColumnSet):
+    """Microchannel designs stored as columns, one row per design"""
+
+    __slots__ = ()
+    keys = DESIGN_KEYS
+
+    @classmethod
+    def from_properties(cls, propertiesList):
+        # designs from a list of microchannelProperties dicts, a missing or None
+        # concPercent is stored as nan
+        columns = {}
+        for key in DESIGN_KEYS:
+            if key in DESIGN_TEXT_KEYS:
+                columns[key] = np.array([p[key] for p in propertiesList])
+            else:
+                columns[key] = np.array([p.get(key) for p in propertiesList], dtype=float)
+        return cls(columns)
+
+    @classmethod
+    def from_presets(cls, names, **columns):
+        # designs from preset names, keyword columns override preset values,
+        # e.g. DesignSet.from_presets(['LSEpiTip'], flowRate=np.linspace(50, 500, 1000))
+        presets = []
+        for name in names:
+            properties = mc.get_preset_properties(name)
+            if properties == None:
+                raise ValueError('unknown preset: {0}'.format(name))
+            presets.append(properties)
+        designs = cls.from_properties(presets)
+        if not columns:
+            return designs
+        for key in columns:
+            if key not in DESIGN_KEYS:
+                raise ValueError('unknown design property: {0}'.format(key))
+        # presets run along a new first axis, the overrides broadcast along the rest
+        ndim = max(np.ndim(columns[key]) for key in columns)
+        merged = dict((key, np.reshape(designs.get_column(key), (-1,) + (1,)*ndim)) for key in DESIGN_KEYS)
+        merged.update(columns)
+        return cls(merged)
+
+    @classmethod
+    def from_models(cls, models):
+        return cls.from_properties([model.get_properties() for model in models])
+
+    def get_properties(self, n):
+        # microchannelProperties dict of one design
+        properties = self.get_record(n)
+        if properties['concPercent'] != properties['concPercent']:
+            properties['concPercent'] = None
+        return properties
+
+    def get_model(self, n, name = None):
+        return mc.Microchannel(name or 'design{0}'.format(n), self.get_properties(n))
+
+    def get_const_pressure_mask(self):
+        isConstP = mb.get_const_pressure_mask(self.levels['flowMode'])
+        return isConstP[self.columns['flowMode']]
+
+    def get_wall_property(self, key):
+        # wall material property ('rho', 'k', 'cp' or 'alpha') of every design,
+        # looked up once per material
+        registry = tp.get_material_registry()
+        values = []
+        for name in self.levels['thermalMaterialName']:
+            index = registry.get_index(name)
+            if index == None:
+                raise ValueError('unknown thermal material: {0}'.format(name))
+            values.append(getattr(registry, key)[index])
+        return np.array(values)[self.columns['thermalMaterialName']]
+
+    def get_footprint(self):
+        return get_footprint(self.columns['channelWidth'], self.columns['wallThickness'],
+                             self.columns['numChannelsPerSplit'], self.columns['numSplits'])
+
+    def get_wall_k(self):
+        return self.get_wall_property('k')
+
+    def get_coolant_properties(self):
+        # coolant properties of every design, evaluated per coolant
+        codes = self.columns['coolantName']
+        properties = dict((key, np.empty(len(self))) for key in cpp.COOLANT_PROPERTY_KEYS)
+        for code, name in enumerate(self.levels['coolantName']):
+            rows = slice(None) if len(self.levels['coolantName']) == 1 else (codes == code)
+            values = cpp.calc_coolant_properties(name, self.columns['coolantT'][rows],
+                                                 self.columns['concPercent'][rows])
+            for key in cpp.COOLANT_PROPERTY_KEYS:
+                properties[key][rows] = values[key]
+        return properties
+
+    def get_batch_columns(self):
+        # calc_channel_perf_batch arguments of every design
+        columns = dict((key, self.columns[key]) for key in mb.BATCH_INPUT_KEYS if key in self.columns)
+        coolant = self.get_coolant_properties()
+        columns['flowMode'] = self.get_const_pressure_mask()
+        columns['wallK'] = self.get_wall_k()
+        columns['coolantK'] = coolant['k']
+        columns['coolantMu'] = coolant['mu']
+        columns['coolantRho'] = coolant['rho']
+        columns['coolantCp'] = coolant['cp']
+        return columns
+
+    def evaluate(self, chunkSize = EVALUATE_CHUNK_SIZE):
+        # calc_channel_perf of every design as a ChannelPerfSet
+        batch = self.get_batch_columns()
+        perf = dict((key, np.empty(len(self))) for key in mb.CHANNEL_PERF_KEYS)
+        for start in range(0, len(self), chunkSize):
+            rows = slice(start, start + chunkSize)
+            chunk = mb.calc_channel_perf_batch(**dict((key, batch[key][rows]) for key in batch))
+            for key in mb.CHANNEL_PERF_KEYS:
+                perf[key][rows] = chunk[key]
+        return ChannelPerfSet(perf)
+
+
+class ChannelPerfSet(ColumnSet):
+    """calc_channel_perf results stored as columns, one row per design"""
+
+    __slots__ = ()
+    keys = mb.CHANNEL_PERF_KEYS
+
+    def get_channel_perf(self, n):
+        # channelPerf dict of one design
+        return self.get_record(n)
+
+
+def write_csv(f, sets, chunkSize = 10000):
+    # write the columns of equal length sets side by side as CSV, e.g.
+    # write_csv(f, [designs, perf]); rows are converted a chunk at a time
+    keys = [key for s in sets for key in s.keys]
+    writer = csv.writer(f)
+    writer.writerow(keys)
+    for start in range(0, len(sets[0]), chunkSize):
+        rows = slice(start, start + chunkSize)
+        columns = [s.get_column(key)[rows].tolist() for s in sets for key in s.keys]
+        writer.writerows(zip(*columns))
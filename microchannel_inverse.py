@@ -0,0 +1,175 @@
+from __future__ import division
+import numpy as np
+import microchannel_batch as mb
+import microchannel_sensitivity as ms
+
+
+# search range of the solved input, flow rate [ccm] or pressure [psi]
+FLOW_RATE_BOUNDS = (1e-3, 1e6)
+PRESSURE_BOUNDS = (1e-6, 1e3)
+
+# per design status of solve_inverse_batch
+SOLVED = 0              # RTotal meets the target at the solved flow rate or pressure
+AT_LOWER_BOUND = 1      # the target is already met at the lower bound, which is returned
+BELOW_RCOND = 2         # infeasible, the target is at or below the base conduction resistance
+ABOVE_UPPER_BOUND = 3   # infeasible, even the upper bound does not reach the target
+NOT_CONVERGED = 4
+
+
+def evaluate_rtotal(columns, key, value, index):
+    # RTotal of the designs at index with the solved input set to value, and its
+    # derivative with respect to log(value)
+    subset = dict((k, columns[k][index]) for k in columns)
+    subset[key] = value
+    perf, sensitivity = ms.calc_channel_perf_sensitivity((key,), **subset)
+    return perf['RTotal'], sensitivity['RTotal'][key]*value
+
+
+def solve_inverse_batch(targetRTotal = None, maxTemperatureRise = None, power = None,
+                        lowerBound = None, upperBound = None, tolerance = 1e-10,
+                        maxIterations = 100, **columns):
+    # Flow rate (constFlow designs) or pressure (constPressure designs) at which
+    # RTotal meets targetRTotal [C/W], or at which power [W] heats the source by
+    # at most maxTemperatureRise [C]. columns are calc_channel_perf_batch inputs;
+    # designs, targets and bounds broadcast against each other. The solved input
+    # in columns is only used for the shape.
+    # RTotal falls monotonically with flow and pressure, towards RCond, so the
+    # root is bracketed in log space and found by Newton steps with the exact
+    # derivative, falling back to bisection whenever a step leaves the bracket or
+    # does not shrink it fast enough. All designs iterate together and only the
+    # unconverged ones are evaluated.
+    # Returns a dict with the solved 'flowRate' and 'pressure', 'status' (SOLVED,
+    # AT_LOWER_BOUND, BELOW_RCOND, ABOVE_UPPER_BOUND, NOT_CONVERGED), 'feasible',
+    # 'RCond', 'RLimit' (RTotal at the upper bound), 'numIterations' and the
+    # channelPerf outputs at the solution; the solved input is nan for infeasible
+    # designs.
+    if targetRTotal is None:
+        if maxTemperatureRise is None or power is None:
+            raise ValueError('give targetRTotal or maxTemperatureRise and power')
+        targetRTotal = np.asarray(maxTemperatureRise, dtype=float)/np.asarray(power, dtype=float)
+
+    isConstP = mb.get_const_pressure_mask(columns['flowMode'])
+    keys = [key for key in mb.BATCH_INPUT_KEYS if key != 'flowMode']
+    arrays = np.broadcast_arrays(isConstP, np.asarray(targetRTotal, dtype=float),
+                                 *[np.asarray(columns[key], dtype=float) for key in keys])
+    shape = arrays[0].shape
+    isConstP = arrays[0].ravel()
+    target = arrays[1].ravel()
+    columns = dict((key, np.array(a).ravel()) for key, a in zip(keys, arrays[2:]))
+    columns['flowMode'] = isConstP
+    n = len(target)
+
+    low = np.where(isConstP, PRESSURE_BOUNDS[0], FLOW_RATE_BOUNDS[0])
+    high = np.where(isConstP, PRESSURE_BOUNDS[1], FLOW_RATE_BOUNDS[1])
+    if lowerBound is not None:
+        low = np.broadcast_to(np.asarray(lowerBound, dtype=float), shape).ravel()
+    if upperBound is not None:
+        high = np.broadcast_to(np.asarray(upperBound, dtype=float), shape).ravel()
+
+    # both cases share the loop; the solved input is flowRate or pressure per design
+    solved = {}
+    for key, mask in (('flowRate', ~isConstP), ('pressure', isConstP)):
+        index = np.nonzero(mask)[0]
+        solved[key] = (index, solve_inverse_subset(columns, key, index, target[index], low[index],
+                                                   high[index], tolerance, maxIterations))
+
+    value = np.empty(n)
+    status = np.empty(n, dtype=np.int8)
+    numIterations = 0
+    RLimit = np.empty(n)
+    for key in solved:
+        index, (v, s, iterations, limit) = solved[key]
+        value[index] = v
+        status[index] = s
+        RLimit[index] = limit
+        numIterations = max(numIterations, iterations)
+
+    final = dict(columns)
+    final['flowRate'] = np.where(isConstP, columns['flowRate'], value)
+    final['pressure'] = np.where(isConstP, value, columns['pressure'])
+    perf = mb.calc_channel_perf_batch(**final)
+    result = dict((key, perf[key].reshape(shape)) for key in perf)
+    result['flowRate'] = perf['f'].reshape(shape)
+    result['pressure'] = perf['P'].reshape(shape)
+    result['status'] = status.reshape(shape)
+    result['feasible'] = (status <= AT_LOWER_BOUND).reshape(shape)
+    result['RLimit'] = RLimit.reshape(shape)
+    result['numIterations'] = numIterations
+    return result
+
+
+def solve_inverse_subset(columns, key, index, target, low, high, tolerance, maxIterations):
+    # safeguarded Newton iteration in x = log(value) for the designs at index,
+    # returns (value, status, numIterations, RTotal at the upper bound)
+    n = len(index)
+    value = np.full(n, np.nan)
+    status = np.full(n, NOT_CONVERGED, dtype=np.int8)
+    if n == 0:
+        return value, status, 0, np.empty(0)
+
+    with np.errstate(all='ignore'):
+        RLow, dLow = evaluate_rtotal(columns, key, low, index)
+        RHigh, dHigh = evaluate_rtotal(columns, key, high, index)
+        RCond = (columns['baseThickness'][index]*1e-1)/(columns['wallK'][index]*columns['sourceArea'][index])
+
+    atLow = RLow <= target
+    value[atLow] = low[atLow]
+    status[atLow] = AT_LOWER_BOUND
+    belowRCond = ~atLow & (target <= RCond)
+    status[belowRCond] = BELOW_RCOND
+    aboveHigh = ~atLow & ~belowRCond & ~(RHigh <= target)
+    status[aboveHigh] = ABOVE_UPPER_BOUND
+
+    # bracket [a, b] in log space with g(a) > 0 >= g(b), g = RTotal - target
+    active = np.nonzero(status == NOT_CONVERGED)[0]
+    a = np.log(low[active])
+    b = np.log(high[active])
+    # start from the end with the smaller residual
+    useLow = (RLow[active] - target[active]) < (target[active] - RHigh[active])
+    x = np.where(useLow, a, b)
+    g = np.where(useLow, RLow[active], RHigh[active]) - target[active]
+    dg = np.where(useLow, dLow[active], dHigh[active])
+    dx = b - a
+    dxOld = dx
+    iteration = 0
+    for iteration in range(1, maxIterations + 1):
+        if len(active) == 0:
+            iteration -= 1
+            break
+        # Newton step unless it leaves the bracket or is not at least halving the
+        # step before last (as in rtsafe), then bisect
+        with np.errstate(all='ignore'):
+            step = -g/dg
+        xNewton = x + step
+        bisect = ~((xNewton > a) & (xNewton < b)) | ~(np.abs(step) <= 0.5*np.abs(dxOld))
+        xNew = np.where(bisect, 0.5*(a + b), xNewton)
+        dxOld = dx
+        dx = xNew - x
+        x = xNew
+
+        with np.errstate(all='ignore'):
+            R, dR = evaluate_rtotal(columns, key, np.exp(x), index[active])
+        g = R - target[active]
+        dg = dR
+        above = ~(g <= 0)           # nan results move the lower end like a miss
+        a = np.where(above, x, a)
+        b = np.where(above, b, x)
+
+        done = ((np.abs(dx) <= tolerance) | (b - a <= tolerance) |
+                (np.abs(g) <= tolerance*target[active]))
+        if done.any():
+            finished = active[done]
+            value[finished] = np.exp(x[done])
+            status[finished] = SOLVED
+            keep = ~done
+            active, a, b, x, g, dg, dx, dxOld = (active[keep], a[keep], b[keep], x[keep], g[keep],
+                                                 dg[keep], dx[keep], dxOld[keep])
+    value[active] = np.exp(b)       # best feasible value of the unconverged designs
+    return value, status, iteration, RHigh
+
+
+def solve_design_inverse(designs, targetRTotal = None, maxTemperatureRise = None, power = None,
+                         lowerBound = None, upperBound = None, **options):
+    # solve_inverse_batch for a DesignSet
+    return solve_inverse_batch(targetRTotal, maxTemperatureRise, power, lowerBound, upperBound,
+                               **dict(designs.get_batch_columns(), **options))
@@ -0,0 +1,237 @@
+from __future__ import division
+import multiprocessing
+import time
+import numpy as np
+import microchannel_batch as mb
+import microchannel_designs as md
+
+
+# default search bounds, channel dimensions in [mm]
+GEOMETRY_BOUNDS = {'channelWidth':(0.1, 2.0),
+                   'channelHeight':(0.1, 5.0),
+                   'wallThickness':(0.1, 2.0),
+                   'numSplits':(1, 8),
+                   'numChannelsPerSplit':(1, 200)}
+
+CONTINUOUS_KEYS = ('channelWidth', 'channelHeight', 'wallThickness')
+INTEGER_KEYS = ('numSplits', 'numChannelsPerSplit')
+
+
+def get_fixed_columns(model):
+    # calc_channel_perf_batch arguments that the optimizer does not change
+    fixed = mb.get_batch_columns([model])
+    for key in CONTINUOUS_KEYS + INTEGER_KEYS:
+        del fixed[key]
+    for key in fixed:
+        fixed[key] = fixed[key][0]
+    return fixed
+
+
+def evaluate_candidates(fixed, candidates):
+    # process pool worker, evaluate one chunk of candidate geometries
+    columns = dict(fixed)
+    columns.update(candidates)
+    return mb.calc_channel_perf_batch(**columns)
+
+
+def optimize_channel_geometry(model, maxPressure = None, maxFlowRate = None, minFeatureSize = 0.1,
+                              maxFootprint = None, targetRTotal = None, bounds = None,
+                              numCandidates = 512, numElites = 16, numIterations = 30, patience = 5,
+                              numProcesses = None, seed = 0):
+    # Search channelWidth, channelHeight, wallThickness (continuous) and numSplits,
+    # numChannelsPerSplit (integer) of a Microchannel for the lowest RTotal, or,
+    # when targetRTotal is given, for the lowest pressure drop (constFlow) or flow
+    # rate (constPressure) that still meets the target.
+    #   maxPressure     pressure drop limit [psi]
+    #   maxFlowRate     flow rate limit [ccm]
+    #   minFeatureSize  smallest etched channel or wall [mm]
+    #   maxFootprint    width available for the channels of all splits side by side
+    #                   (microchannel_designs.get_footprint) [mm], defaults to the
+    #                   heat source width
+    # The search starts from the current design and the analytic zcOpt/wcOpt0
+    # guesses, then samples around the best designs found so far with a shrinking
+    # step. Geometrically infeasible candidates are pruned before evaluation and the
+    # rest is evaluated in chunks spread across a process pool.
+    startTime = time.time()
+    rng = np.random.RandomState(seed)
+
+    bounds = dict(GEOMETRY_BOUNDS, **(bounds or {}))
+    lower = {}
+    upper = {}
+    for key in CONTINUOUS_KEYS:
+        lower[key] = max(bounds[key][0], minFeatureSize)
+        upper[key] = max(bounds[key][1], lower[key])
+    for key in INTEGER_KEYS:
+        lower[key] = int(bounds[key][0])
+        upper[key] = int(bounds[key][1])
+    if maxFootprint == None:
+        maxFootprint = model.sourceWidth*10
+
+    fixed = get_fixed_columns(model)
+    isConstP = bool(mb.get_const_pressure_mask(model.flowMode))
+
+    # starting points: the current design and the analytic guesses
+    channelPerf = model.calc_channel_perf()
+    seeds = {'channelWidth':[model.channelWidth, channelPerf['wcOpt0'], channelPerf['wcOpt0']],
+             'channelHeight':[model.channelHeight, model.channelHeight, channelPerf['zcOpt']],
+             'wallThickness':[model.wallThickness]*3,
+             'numSplits':[model.numSplits]*3,
+             'numChannelsPerSplit':[model.numChannelsPerSplit]*3}
+    candidates = dict((key, np.array(seeds[key], dtype=float)) for key in seeds)
+    # fill the footprint with channels for the guessed widths
+    pitch = candidates['channelWidth'] + candidates['wallThickness']
+    splitWidth = maxFootprint/candidates['numSplits']
+    candidates['numChannelsPerSplit'][1:] = np.floor((splitWidth[1:] + candidates['wallThickness'][1:])/pitch[1:])
+    candidates = clip_candidates(candidates, lower, upper)
+    sample = sample_uniform(rng, numCandidates, lower, upper)
+    candidates = dict((key, np.concatenate((candidates[key], sample[key]))) for key in candidates)
+
+    if numProcesses == None:
+        numProcesses = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(numProcesses) if numProcesses > 1 else None
+
+    best = None
+    bestScore = None
+    numEvaluations = 0
+    numPruned = 0
+    numStale = 0
+    step = 0.25         # relative sampling step around the elites
+    iteration = 0
+    try:
+        for iteration in range(numIterations):
+            # early pruning of designs that violate the feature size or footprint
+            feasible = (md.get_footprint(candidates['channelWidth'], candidates['wallThickness'],
+                                         candidates['numChannelsPerSplit'], candidates['numSplits'])
+                        <= maxFootprint)
+            numPruned += int(np.count_nonzero(~feasible))
+            candidates = dict((key, candidates[key][feasible]) for key in candidates)
+
+            n = len(candidates['channelWidth'])
+            if n > 0:
+                perf = evaluate_in_chunks(pool, numProcesses, fixed, candidates)
+                numEvaluations += n
+
+                # drop designs that break the hydraulic limits
+                feasible = np.isfinite(perf['RTotal'])
+                if maxPressure != None:
+                    feasible &= (perf['P'] <= maxPressure)
+                if maxFlowRate != None:
+                    feasible &= (perf['f'] <= maxFlowRate)
+                numPruned += int(np.count_nonzero(~feasible))
+
+                population = merge_population(best, candidates, perf, feasible)
+                order = rank_designs(population['perf'], targetRTotal, isConstP)[:numElites]
+                if len(order) > 0:
+                    best = {'design':dict((key, population['design'][key][order]) for key in population['design']),
+                            'perf':dict((key, population['perf'][key][order]) for key in population['perf'])}
+                    score = get_score(best['perf'], targetRTotal, isConstP)
+                    if bestScore == None or score < bestScore:
+                        bestScore = score
+                        numStale = 0
+                    else:
+                        numStale += 1
+                        step *= 0.5
+                if numStale >= patience:
+                    break
+
+            if best == None:
+                candidates = sample_uniform(rng, numCandidates, lower, upper)
+            else:
+                candidates = sample_around(rng, best['design'], numCandidates, step, lower, upper)
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+
+    result = {}
+    result['numEvaluations'] = numEvaluations
+    result['numPruned'] = numPruned
+    result['numIterations'] = iteration + 1
+    result['wallTime'] = time.time() - startTime
+    if best == None:
+        result['feasible'] = False
+        result['microchannelProperties'] = None
+        result['channelPerf'] = None
+        return result
+
+    microchannelProperties = model.get_properties()
+    for key in CONTINUOUS_KEYS:
+        microchannelProperties[key] = float(best['design'][key][0])
+    for key in INTEGER_KEYS:
+        microchannelProperties[key] = int(best['design'][key][0])
+    result['feasible'] = (targetRTotal == None or best['perf']['RTotal'][0] <= targetRTotal)
+    result['microchannelProperties'] = microchannelProperties
+    result['channelPerf'] = dict((key, float(best['perf'][key][0])) for key in best['perf'])
+    return result
+
+
+def evaluate_in_chunks(pool, numProcesses, fixed, candidates):
+    n = len(candidates['channelWidth'])
+    if pool == None or n < 2*numProcesses:
+        return evaluate_candidates(fixed, candidates)
+    chunks = []
+    for index in np.array_split(np.arange(n), numProcesses):
+        chunks.append((fixed, dict((key, candidates[key][index]) for key in candidates)))
+    results = pool.map(evaluate_candidates_star, chunks)
+    return dict((key, np.concatenate([r[key] for r in results])) for key in results[0])
+
+
+def evaluate_candidates_star(args):
+    return evaluate_candidates(*args)
+
+
+def merge_population(best, candidates, perf, feasible):
+    design = dict((key, candidates[key][feasible]) for key in candidates)
+    perf = dict((key, perf[key][feasible]) for key in perf)
+    if best != None:
+        design = dict((key, np.concatenate((best['design'][key], design[key]))) for key in design)
+        perf = dict((key, np.concatenate((best['perf'][key], perf[key]))) for key in perf)
+    return {'design':design, 'perf':perf}
+
+
+def rank_designs(perf, targetRTotal, isConstP):
+    # indices of the designs from best to worst
+    if targetRTotal == None:
+        return np.argsort(perf['RTotal'], kind='mergesort')
+    # meet the target first, then use the least pressure (or flow)
+    shortfall = np.maximum(perf['RTotal'] - targetRTotal, 0)
+    cost = perf['f'] if isConstP else perf['P']
+    return np.lexsort((cost, shortfall))
+
+
+def get_score(perf, targetRTotal, isConstP):
+    # comparable objective value of the best ranked design
+    if targetRTotal == None:
+        return perf['RTotal'][0]
+    cost = perf['f'][0] if isConstP else perf['P'][0]
+    return (max(perf['RTotal'][0] - targetRTotal, 0), cost)
+
+
+def clip_candidates(candidates, lower, upper):
+    for key in CONTINUOUS_KEYS:
+        candidates[key] = np.clip(candidates[key], lower[key], upper[key])
+    for key in INTEGER_KEYS:
+        candidates[key] = np.clip(np.round(candidates[key]), lower[key], upper[key])
+    return candidates
+
+
+def sample_uniform(rng, n, lower, upper):
+    # log-uniform dimensions and uniform integer counts inside the bounds
+    candidates = {}
+    for key in CONTINUOUS_KEYS:
+        candidates[key] = np.exp(rng.uniform(np.log(lower[key]), np.log(upper[key]), n))
+    for key in INTEGER_KEYS:
+        candidates[key] = rng.randint(lower[key], upper[key] + 1, n).astype(float)
+    return candidates
+
+
+def sample_around(rng, elites, n, step, lower, upper):
+    # log-normal perturbations of the elite designs, integer counts move by a few units
+    parent = rng.randint(0, len(elites['channelWidth']), n)
+    candidates = {}
+    for key in CONTINUOUS_KEYS:
+        candidates[key] = elites[key][parent]*np.exp(step*rng.standard_normal(n))
+    for key in INTEGER_KEYS:
+        spread = max(1.0, step*elites[key].max())
+        candidates[key] = elites[key][parent] + np.round(spread*rng.standard_normal(n))
+    return clip_candidates(candidates, lower, upper)
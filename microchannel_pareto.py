@@ -0,0 +1,176 @@
+from __future__ import division
+import bisect
+import numpy as np
+import microchannel_batch as mb
+import microchannel_designs as md
+
+
+# objectives are minimized; any channelPerf key or 'footprint', the width the
+# channels of all splits take across the source, microchannel_designs.get_footprint [mm]
+DEFAULT_OBJECTIVES = ('RTotal', 'P')
+DERIVED_OBJECTIVES = ('footprint',)
+PREFILTER_SIZE = 16     # points of a chunk used to screen out the clearly dominated rest
+
+
+def get_objective_values(designs, perf, objectives):
+    # (numDesigns, numObjectives) array of the objectives of a DesignSet and its ChannelPerfSet
+    values = np.empty((len(perf), len(objectives)))
+    for n, key in enumerate(objectives):
+        if key == 'footprint':
+            values[:, n] = designs.get_footprint()
+        elif key in mb.CHANNEL_PERF_KEYS:
+            values[:, n] = perf.columns[key]
+        else:
+            raise ValueError('unknown objective: {0}'.format(key))
+    return values
+
+
+def get_front_mask(values):
+    # Non-dominated rows of values (numPoints, 2 or 3), all objectives minimized.
+    # A point is dominated when another is no worse in every objective and better
+    # in one, so exact duplicates of a front point are kept as well. Rows with a
+    # nan are never on the front. O(N log N): a sort plus a sweep.
+    values = np.asarray(values, dtype=float)
+    numPoints, numObjectives = values.shape
+    if numObjectives not in (2, 3):
+        raise ValueError('2 or 3 objectives are supported, not {0}'.format(numObjectives))
+    mask = np.zeros(numPoints, dtype=bool)
+    valid = np.nonzero(~np.isnan(values).any(axis=1))[0]
+    if len(valid) == 0:
+        return mask
+
+    # lexicographic order, a dominating point always comes before the points it dominates
+    order = valid[np.lexsort(values[valid].T[::-1])]
+    v = values[order]
+    # the first of every run of identical points decides for the whole run
+    isFirst = np.ones(len(v), dtype=bool)
+    isFirst[1:] = (v[1:] != v[:-1]).any(axis=1)
+    first = np.maximum.accumulate(np.where(isFirst, np.arange(len(v)), 0))
+
+    if numObjectives == 2:
+        # on the front when strictly below the smallest f2 of every earlier point
+        previousMin = np.empty(len(v))
+        previousMin[0] = np.inf
+        previousMin[1:] = np.minimum.accumulate(v[:-1, 1])
+        keep = v[:, 1] < previousMin
+    else:
+        keep = sweep_front_3d(v, isFirst, prefilter_dominated(v))
+    mask[order] = keep[first]
+    return mask
+
+
+def prefilter_dominated(v):
+    # points strictly dominated by one of a small screening set, the minima of
+    # random weighted sums of the normalized objectives, which lie on the front
+    # and spread along it; removes most of a dense sweep before the per-point
+    # 3d sweep
+    low = v.min(axis=0)
+    span = v.max(axis=0) - low
+    span[span == 0] = 1
+    weights = np.random.RandomState(0).dirichlet(np.ones(v.shape[1]), PREFILTER_SIZE)/span
+    columns = [v[:, k].copy() for k in range(v.shape[1])]
+    dominated = np.zeros(len(v), dtype=bool)
+    for w in weights:
+        s = v[np.argmin(v.dot(w))]
+        noWorse = columns[0] >= s[0]
+        better = columns[0] > s[0]
+        for k in range(1, len(columns)):
+            noWorse &= columns[k] >= s[k]
+            better |= columns[k] > s[k]
+        dominated |= noWorse & better
+    return dominated
+
+
+def sweep_front_3d(v, isFirst, dominated):
+    # Kung's sweep over points sorted by (f1, f2, f3): a point is dominated when an
+    # earlier one has f2 and f3 no larger. The earlier non-dominated points are
+    # kept as a staircase in (f2, f3), f2 increasing and f3 decreasing, searched
+    # by bisection.
+    keep = np.zeros(len(v), dtype=bool)
+    stairF2 = []
+    stairF3 = []
+    candidates = np.nonzero(isFirst & ~dominated)[0]
+    f2 = v[candidates, 1].tolist()
+    f3 = v[candidates, 2].tolist()
+    for n, q2, q3 in zip(candidates.tolist(), f2, f3):
+        i = bisect.bisect_right(stairF2, q2)
+        if i > 0 and stairF3[i - 1] <= q3:
+            continue
+        keep[n] = True
+        # drop the steps the new point covers, then insert it
+        j = i
+        while j < len(stairF2) and stairF3[j] >= q3:
+            j += 1
+        stairF2[i:j] = [q2]
+        stairF3[i:j] = [q3]
+    return keep
+
+
+class ParetoArchive(object):
+    """Non-dominated designs of a stream of evaluated chunks; only the front is
+    held, so sweeps of any size can be merged a chunk at a time"""
+
+    def __init__(self, objectives = DEFAULT_OBJECTIVES):
+        for key in objectives:
+            if key not in mb.CHANNEL_PERF_KEYS and key not in DERIVED_OBJECTIVES:
+                raise ValueError('unknown objective: {0}'.format(key))
+        self.objectives = tuple(objectives)
+        self.designs = None     # DesignSet of the front
+        self.perf = None        # ChannelPerfSet of the front
+        self.values = np.empty((0, len(self.objectives)))
+        self.numSeen = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, designs, perf = None):
+        # merge a chunk of designs, evaluated unless its ChannelPerfSet is given
+        if perf == None:
+            perf = designs.evaluate()
+        self.numSeen += len(designs)
+        values = get_objective_values(designs, perf, self.objectives)
+        # reduce the chunk on its own first, so the merge only sees its front
+        mask = get_front_mask(values)
+        designs = designs.take(mask)
+        perf = perf.take(mask)
+        values = values[mask]
+        if self.designs != None:
+            designs = md.DesignSet.concatenate([self.designs, designs])
+            perf = md.ChannelPerfSet.concatenate([self.perf, perf])
+            values = np.concatenate([self.values, values])
+            mask = get_front_mask(values)
+            designs = designs.take(mask)
+            perf = perf.take(mask)
+            values = values[mask]
+        self.designs = designs
+        self.perf = perf
+        self.values = values
+
+    def merge(self, other):
+        # combine with an archive of the same objectives, e.g. from another process
+        if other.designs != None:
+            numSeen = self.numSeen + other.numSeen
+            self.add(other.designs, other.perf)
+            self.numSeen = numSeen
+
+    def get_front(self):
+        # (designs, perf, objective values) of the front, ordered by the first objective
+        if self.designs == None:
+            return None, None, self.values
+        order = np.lexsort(self.values.T[::-1])
+        return self.designs.take(order), self.perf.take(order), self.values[order]
+
+    def write_csv(self, f):
+        # the front with its design parameters and channelPerf, one row per design
+        designs, perf, values = self.get_front()
+        if designs != None:
+            md.write_csv(f, [designs, perf])
+
+
+def run_pareto_sweep(designChunks, objectives = DEFAULT_OBJECTIVES):
+    # archive of the non-dominated designs of an iterable of DesignSet chunks,
+    # e.g. a generator that builds the chunks of a large grid lazily
+    archive = ParetoArchive(objectives)
+    for designs in designChunks:
+        archive.add(designs)
+    return archive
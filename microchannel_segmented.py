@@ -0,0 +1,158 @@
+from __future__ import division
+import numpy as np
+import microchannel_batch as mb
+import coolant_properties as cpp
+
+
+def calc_nu_length(DRePr, x, NuInf):
+    # x*NuAvg(x), the average Nusselt number of calc_channel_perf over the first x of
+    # the channel times x; it goes to zero at the channel entrance
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Gz = DRePr/x
+        NuL = x*NuInf + (0.0668*DRePr)/(1 + 0.04*np.cbrt(Gz)**2)
+    return np.where(x > 0, NuL, 0.0)
+
+
+def get_coolant_groups(coolantName, shape):
+    # (name, rows) of the designs sharing a coolant, rows is None when all designs do
+    names = np.char.lower(np.broadcast_to(np.asarray(coolantName).astype(str), shape))
+    uniqueNames = np.unique(names)
+    if len(uniqueNames) == 1:
+        return [(str(uniqueNames[0]), None)]
+    return [(str(name), np.nonzero(names == name)[0]) for name in uniqueNames]
+
+
+def calc_group_property(groups, key, coolantT, concPercent):
+    # one coolant property of every design row, coolantT is (M, N) and concPercent (M, 1)
+    if groups[0][1] is None:
+        return cpp.calc_coolant_property(groups[0][0], key, coolantT, concPercent)
+    values = np.empty(coolantT.shape)
+    for name, rows in groups:
+        values[rows] = cpp.calc_coolant_property(name, key, coolantT[rows], concPercent[rows])
+    return values
+
+
+def calc_group_properties(groups, coolantT, concPercent):
+    return dict((key, calc_group_property(groups, key, coolantT, concPercent))
+                for key in cpp.COOLANT_PROPERTY_KEYS)
+
+
+def calc_channel_perf_segmented(channelWidth, channelHeight, channelLength, baseThickness,
+                                wallThickness, numSplits, numChannelsPerSplit, sourceArea,
+                                flowMode, flowRate, pressure, headloss, nuInf, wallK,
+                                coolantName, coolantT, concPercent, power, numSegments = 100,
+                                maxIterations = 20, tolerance = 1e-6):
+    # Axial marching version of calc_channel_perf_batch. The channel length is split
+    # into numSegments segments that each take power/numSegments of the heat load [W].
+    # Coolant properties are re-evaluated at the inlet temperature of every segment
+    # (coolant_properties, the array form of the get_* functions), the coolant heats
+    # up along the channel and the local pressure drop, Nusselt number and wall
+    # temperature are accumulated per segment.
+    # Design arguments broadcast to shape (M,); per segment results have shape (M, N).
+    # The temperature profile depends on cp along the channel, so it is found by
+    # fixed-point sweeps that are each vectorized over designs and segments; the
+    # profile converges in a few sweeps since the properties vary slowly.
+    # With numSegments = 1 the results reduce to calc_channel_perf.
+    N = int(numSegments)
+    isConstP = mb.get_const_pressure_mask(flowMode)
+    (wc, zc, Lc, zb, ww, nsp, nc, As, f, P, Ph, NuInf, kw, Tin, conc, Q, isConstP) = [
+        np.array(a, dtype=float) if a.dtype != bool else a for a in np.broadcast_arrays(
+            np.atleast_1d(channelWidth), channelHeight, channelLength, baseThickness, wallThickness,
+            numSplits, numChannelsPerSplit, sourceArea, flowRate, pressure, headloss, nuInf,
+            wallK, coolantT, concPercent, power, isConstP)]
+    groups = get_coolant_groups(coolantName, Tin.shape)
+    col = lambda a: a[:, np.newaxis]        # design column against the segment axis
+
+    D = 4*wc*zc/(2*(zc + wc))			# channel characteristic width [mm]
+    B = (np.pi*(D**2)/4)/(wc*zc)		# cross section shape factor
+    C = 16*np.exp(0.294*(B**2) + 0.068*B - 0.318)      # fRe, C factor
+    flowArea = nsp*nc*wc*zc*1e-2        # total flow cross section [cm2]
+    alpha = nsp*nc*(2*zc + wc)*Lc/(As*1e2)      # surface area multiplication factor
+    dx = Lc/N                           # segment length
+    x = np.arange(1, N + 1)*col(dx)     # segment end positions
+    q = Q/N                             # heat load per segment [W]
+    RCond = N*(zb*1e-1)/(kw*As)         # base conduction resistance of one segment [C/W]
+
+    concCol = col(conc)
+    rhoIn = calc_group_property(groups, 'rho', col(Tin), concCol)[:, 0]
+    c1 = Ph*(rhoIn*1e3)/2		# coefficient due to pressure head loss
+    anyConstP = isConstP.any()
+    v = (f/60)/flowArea                 # inlet mean flow velocity for constant flow rate [cm/s]
+    TSeg = np.repeat(col(Tin), N, axis=1)       # coolant temperature at the segment inlets
+    for iteration in range(maxIterations):
+        if anyConstP:
+            # the mass flow is set at the inlet, the local velocity follows the density
+            rhoRatio = col(rhoIn)/calc_group_property(groups, 'rho', TSeg, concCol)
+            mu = calc_group_property(groups, 'mu', TSeg, concCol)
+            c2Eff = (2*C*1e4*(dx*1e-3)/((D*1e-3)**2))*(mu*rhoRatio).sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                vConstP = np.where(c1 == 0, 1e2*((P/1.4504e-4)/c2Eff),
+                                   1e2*((-c2Eff + (c2Eff**2 + 4*c1*(P/1.4504e-4))**0.5)/(2*np.where(c1 == 0, 1, c1))))
+            v = np.where(isConstP, vConstP, (f/60)/flowArea)
+        mDot = rhoIn*v*flowArea             # mass flow [g/s]
+
+        # coolant temperature rise per segment and the resulting inlet temperatures
+        dT = col(q/mDot)/calc_group_property(groups, 'cp', TSeg, concCol)
+        TNext = np.cumsum(dT, axis=1)
+        TNext -= dT
+        TNext += col(Tin)
+        change = np.max(np.abs(TNext - TSeg))
+        TSeg = TNext
+        if change <= tolerance:
+            break
+    fOut = 60*v*flowArea                # flow rate at the inlet [ccm]
+    props = calc_group_properties(groups, TSeg, concCol)
+    rhoRatio = col(rhoIn)/props['rho']
+    c2 = (2*col(C)*(props['mu']*1e4)*(col(dx)*1e-3))/((col(D)*1e-3)**2)
+    dT = col(q/mDot)/props['cp']
+
+    vSeg = col(v)*rhoRatio              # local mean flow velocity [cm/s]
+    dP = 1.4504e-4*c2*(vSeg*1e-2)       # local laminar pressure drop [psi]
+    PHead = 1.4504e-4*c1*(v*1e-2)**2    # head loss at the inlet [psi]
+    PSeg = col(PHead) + np.cumsum(dP, axis=1)   # pressure drop from the inlet to the segment end
+
+    Re = (vSeg*1e-2)*(col(D)*1e-3)*(props['rho']*1e3)/(props['mu']*1e4)
+    Pr = (props['mu']*1e4)*(props['cp']*1e3)/(props['k']*1e2)
+    DRePr = col(D)*Re*Pr
+    # segment Nusselt number from the growth of x*NuAvg(x) over the segment; x*NuAvg is
+    # evaluated once per segment end with the local properties and differenced
+    NuL = calc_nu_length(DRePr, x, col(NuInf))
+    Nu = np.diff(NuL, axis=1, prepend=0.0)/col(dx)
+    h = Nu*props['k']/(col(D)*1e-1)             # local heat transfer coefficient [W/C-cm^2]
+    RConv = N/(h*col(alpha*As))                 # convection resistance of one segment [C/W]
+
+    coolantTSeg = TSeg + dT/2                   # mean coolant temperature in the segment
+    wallT = coolantTSeg + col(q)*RConv          # channel wall temperature
+    sourceT = wallT + col(q*RCond)              # heat source temperature
+
+    perf = {}
+    perf['x'] = x - col(dx)/2           # segment centers
+    perf['coolantT'] = coolantTSeg
+    perf['wallT'] = wallT
+    perf['sourceT'] = sourceT
+    perf['dP'] = dP
+    perf['pressureDrop'] = PSeg
+    perf['Re'] = Re
+    perf['Nu'] = Nu
+    perf['h'] = h
+    perf['mu'] = props['mu']
+    perf['v'] = v
+    perf['P'] = PSeg[:, -1]
+    perf['f'] = fOut
+    perf['outletT'] = TSeg[:, -1] + dT[:, -1]
+    perf['maxWallT'] = wallT.max(axis=1)
+    perf['maxSourceT'] = sourceT.max(axis=1)
+    perf['RTotal'] = (perf['maxSourceT'] - Tin)/Q      # hot spot thermal resistance [C/W]
+    perf['numIterations'] = iteration + 1
+    return perf
+
+
+def calc_microchannel_perf_segmented(models, power, numSegments = 100):
+    # evaluate a list of Microchannel objects with the marching model
+    columns = mb.get_batch_columns(models)
+    for key in ('sourceWidth', 'coolantK', 'coolantMu', 'coolantRho', 'coolantCp'):
+        del columns[key]
+    columns['coolantName'] = np.array([m.coolant.name for m in models])
+    columns['coolantT'] = np.array([m.coolant.coolantT for m in models], dtype=float)
+    columns['concPercent'] = np.array([getattr(m.coolant, 'concPercent', 0) for m in models], dtype=float)
+    return calc_channel_perf_segmented(power=power, numSegments=numSegments, **columns)
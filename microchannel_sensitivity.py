@@ -0,0 +1,188 @@
+from __future__ import division
+import numpy as np
+import microchannel_batch as mb
+
+
+# calc_channel_perf_batch inputs that derivatives can be taken against
+SENSITIVITY_KEYS = tuple(key for key in mb.BATCH_INPUT_KEYS if key != 'flowMode')
+SENSITIVITY_CHUNK_SIZE = 2048       # designs per pass, small enough to keep the derivative arrays in cache
+
+
+class Dual(object):
+    """Array values with forward-mode derivatives, grad[n] is d(value)/d(input n)"""
+
+    __slots__ = ('value', 'grad')
+    __array_ufunc__ = None      # make numpy arrays and scalars defer to the reflected operators
+
+    def __init__(self, value, grad):
+        self.value = value
+        self.grad = grad
+
+    def __add__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value + other.value, self.grad + other.grad)
+        return Dual(self.value + other, self.grad)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value - other.value, self.grad - other.grad)
+        return Dual(self.value - other, self.grad)
+
+    def __rsub__(self, other):
+        return Dual(other - self.value, -self.grad)
+
+    def __neg__(self):
+        return Dual(-self.value, -self.grad)
+
+    def __mul__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value*other.value, self.grad*other.value + other.grad*self.value)
+        return Dual(self.value*other, self.grad*other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Dual):
+            value = self.value/other.value
+            return Dual(value, (self.grad - other.grad*value)/other.value)
+        return Dual(self.value/other, self.grad/other)
+
+    def __rtruediv__(self, other):
+        value = other/self.value
+        return Dual(value, -self.grad*(value/self.value))
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __pow__(self, p):
+        # constant exponents only, which is all the channel equations use
+        if p == 2:
+            return Dual(self.value*self.value, self.grad*(2*self.value))
+        return Dual(self.value**p, self.grad*(p*self.value**(p - 1)))
+
+    def __eq__(self, other):
+        return self.value == (other.value if isinstance(other, Dual) else other)
+
+    def __ne__(self, other):
+        return self.value != (other.value if isinstance(other, Dual) else other)
+
+    __hash__ = None
+
+
+def dual_exp(x):
+    if not isinstance(x, Dual):
+        return np.exp(x)
+    value = np.exp(x.value)
+    return Dual(value, x.grad*value)
+
+
+def dual_tanh(x):
+    if not isinstance(x, Dual):
+        return np.tanh(x)
+    value = np.tanh(x.value)
+    return Dual(value, x.grad*(1 - value*value))
+
+
+def dual_where(condition, x, y):
+    # np.where on values and derivatives; the branch that is not taken does not
+    # leak nan or inf derivatives into the result
+    if not isinstance(x, Dual) and not isinstance(y, Dual):
+        return np.where(condition, x, y)
+    xValue, xGrad = (x.value, x.grad) if isinstance(x, Dual) else (x, 0.0)
+    yValue, yGrad = (y.value, y.grad) if isinstance(y, Dual) else (y, 0.0)
+    return Dual(np.where(condition, xValue, yValue), np.where(condition, xGrad, yGrad))
+
+
+class DualMath(object):
+    """The xp namespace of calc_channel_perf_equations for Dual numbers"""
+
+    __slots__ = ()
+    exp = staticmethod(dual_exp)
+    tanh = staticmethod(dual_tanh)
+    where = staticmethod(dual_where)
+
+
+def calc_channel_perf_sensitivity(wrt = None, channelWidth = None, channelHeight = None,
+                                  channelLength = None, baseThickness = None, wallThickness = None,
+                                  numSplits = None, numChannelsPerSplit = None, sourceWidth = None,
+                                  sourceArea = None, flowMode = None, flowRate = None, pressure = None,
+                                  headloss = None, nuInf = None, wallK = None, coolantK = None,
+                                  coolantMu = None, coolantRho = None, coolantCp = None):
+    # calc_channel_perf_batch plus the exact derivatives of every channelPerf output
+    # with respect to the inputs named in wrt (default all of SENSITIVITY_KEYS).
+    # The derivatives are carried through the batch equations in forward mode, so
+    # the cost is about one evaluation per input in wrt, all vectorized over designs.
+    # Returns (channelPerf, sensitivity) with sensitivity[output][input] an array of
+    # d(output)/d(input); in constant flow mode pressure has no effect and in
+    # constant pressure mode flowRate has none, so those derivatives are zero.
+    if wrt == None:
+        wrt = SENSITIVITY_KEYS
+    for key in wrt:
+        if key not in SENSITIVITY_KEYS:
+            raise ValueError('unknown sensitivity input: {0}'.format(key))
+    values = dict(channelWidth=channelWidth, channelHeight=channelHeight, channelLength=channelLength,
+                  baseThickness=baseThickness, wallThickness=wallThickness, numSplits=numSplits,
+                  numChannelsPerSplit=numChannelsPerSplit, sourceWidth=sourceWidth, sourceArea=sourceArea,
+                  flowRate=flowRate, pressure=pressure, headloss=headloss, nuInf=nuInf, wallK=wallK,
+                  coolantK=coolantK, coolantMu=coolantMu, coolantRho=coolantRho, coolantCp=coolantCp)
+    isConstP = mb.get_const_pressure_mask(flowMode)
+    arrays = np.broadcast_arrays(isConstP, *[np.asarray(values[key], dtype=float) for key in SENSITIVITY_KEYS])
+    isConstP = arrays[0]
+    args = dict((key, np.array(a)) for key, a in zip(SENSITIVITY_KEYS, arrays[1:]))
+
+    # seed every input in wrt with a unit derivative of its own
+    for n, key in enumerate(wrt):
+        grad = np.zeros((len(wrt),) + isConstP.shape)
+        grad[n] = 1.0
+        args[key] = Dual(args[key], grad)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = mb.calc_channel_perf_equations(
+            args['channelWidth'], args['channelHeight'], args['channelLength'], args['baseThickness'],
+            args['wallThickness'], args['numSplits'], args['numChannelsPerSplit'], args['sourceWidth']*10,
+            args['sourceArea'], args['flowRate'], args['pressure'], args['headloss'], args['nuInf'],
+            args['wallK'], args['coolantK'], args['coolantMu'], args['coolantRho'], args['coolantCp'],
+            isConstP, DualMath)
+
+    perf = {}
+    sensitivity = {}
+    for key in mb.CHANNEL_PERF_KEYS:
+        output = result[key]
+        sensitivity[key] = {}
+        if isinstance(output, Dual):
+            perf[key] = output.value
+            for n, inputKey in enumerate(wrt):
+                sensitivity[key][inputKey] = np.broadcast_to(output.grad[n], isConstP.shape)
+        else:
+            perf[key] = output
+            for inputKey in wrt:
+                sensitivity[key][inputKey] = np.zeros(isConstP.shape)
+    return perf, sensitivity
+
+
+def calc_design_sensitivity(designs, wrt = None, chunkSize = SENSITIVITY_CHUNK_SIZE):
+    # calc_channel_perf_sensitivity of a DesignSet in chunks of designs, returns
+    # (ChannelPerfSet, sensitivity) with the sensitivity arrays covering all designs
+    import microchannel_designs as md
+    if wrt == None:
+        wrt = SENSITIVITY_KEYS
+    batch = designs.get_batch_columns()
+    perf = dict((key, np.empty(len(designs))) for key in mb.CHANNEL_PERF_KEYS)
+    sensitivity = dict((key, dict((inputKey, np.empty(len(designs))) for inputKey in wrt))
+                       for key in mb.CHANNEL_PERF_KEYS)
+    for start in range(0, len(designs), chunkSize):
+        rows = slice(start, start + chunkSize)
+        chunkPerf, chunkSensitivity = calc_channel_perf_sensitivity(
+            wrt, **dict((key, batch[key][rows]) for key in batch))
+        for key in mb.CHANNEL_PERF_KEYS:
+            perf[key][rows] = chunkPerf[key]
+            for inputKey in wrt:
+                sensitivity[key][inputKey][rows] = chunkSensitivity[key][inputKey]
+    return md.ChannelPerfSet(perf), sensitivity
+
+
+def calc_microchannel_sensitivity(models, wrt = None):
+    # calc_channel_perf_sensitivity of a list of Microchannel objects
+    return calc_channel_perf_sensitivity(wrt, **mb.get_batch_columns(models))
@@ -0,0 +1,345 @@
+#!/usr/bin/python3
+import asyncio
+import collections
+import concurrent.futures
+import http.client
+import json
+import multiprocessing
+import sys
+import time
+import microchannel_stream as ms
+import instrumentation
+from thermal_properties import get_material_registry
+
+
+# Local evaluation service, Python 3 only (asyncio). Designs are JSON objects
+# like the rows of microchannel_stream: microchannelProperties keys, optionally
+# a preset 'name' that supplies the keys left out.
+#   POST /evaluate  one design object, or a list of them, returns the records
+#                   with the channelPerf keys added (or an 'error' field)
+#   GET  /metrics   request, batch and latency statistics
+#   GET  /health
+# Concurrent requests are coalesced into micro-batches: the first design to
+# arrive opens a short window, everything arriving within it is evaluated in
+# one calc_channel_perf_batch call on the worker pool.
+DEFAULT_PORT = 8765
+DEFAULT_WINDOW = 0.002          # micro-batch collection window [s]
+DEFAULT_MAX_BATCH_SIZE = 4096   # designs per batch, larger requests are split
+THROUGHPUT_WINDOW = 10.0        # recent throughput is measured over this many seconds [s]
+MAX_BODY_SIZE = 64*1024*1024
+
+
+def warm_up():
+    # load the material table once per process, so no request pays for it
+    get_material_registry().load()
+
+
+def evaluate_rows(rows):
+    # worker: records of a list of design rows, in order
+    records = ms.evaluate_chunk([(n, row, None) for n, row in enumerate(rows)])
+    for record in records:
+        del record['line']
+    return records
+
+
+class ServerMetrics(object):
+    """Counters and latency statistics of the evaluation service"""
+
+    def __init__(self):
+        self.startTime = time.time()
+        self.counts = {'requests':0, 'designs':0, 'batches':0, 'designErrors':0, 'httpErrors':0}
+        self.maxBatchSize = 0
+        self.stages = dict((name, instrumentation.StageStats(name))
+                           for name in ('request', 'queue', 'evaluate'))
+        self.recent = collections.deque()       # (time, numDesigns) of the recent batches
+
+    def add_latency(self, name, elapsed):
+        self.stages[name].add(elapsed, elapsed)
+
+    def add_batch(self, numDesigns, numErrors):
+        now = time.time()
+        self.counts['batches'] += 1
+        self.counts['designs'] += numDesigns
+        self.counts['designErrors'] += numErrors
+        self.maxBatchSize = max(self.maxBatchSize, numDesigns)
+        self.recent.append((now, numDesigns))
+        while self.recent and self.recent[0][0] < now - THROUGHPUT_WINDOW:
+            self.recent.popleft()
+
+    def get_summary(self):
+        now = time.time()
+        uptime = now - self.startTime
+        recent = sum(n for t, n in self.recent if t >= now - THROUGHPUT_WINDOW)
+        summary = dict(self.counts)
+        summary['uptime'] = uptime
+        summary['throughput'] = self.counts['designs']/uptime if uptime > 0 else 0.0
+        summary['recentThroughput'] = recent/min(THROUGHPUT_WINDOW, uptime) if uptime > 0 else 0.0
+        summary['meanBatchSize'] = (self.counts['designs']/self.counts['batches']
+                                    if self.counts['batches'] else 0.0)
+        summary['maxBatchSize'] = self.maxBatchSize
+        summary['latency'] = dict((name, self.stages[name].get_summary()) for name in self.stages)
+        return summary
+
+
+class MicroBatcher(object):
+    """Coalesces the designs of concurrent requests into batches for the worker pool"""
+
+    def __init__(self, executor, numSlots, window = DEFAULT_WINDOW,
+                 maxBatchSize = DEFAULT_MAX_BATCH_SIZE, metrics = None):
+        self.executor = executor
+        self.window = window
+        self.maxBatchSize = maxBatchSize
+        self.metrics = metrics or ServerMetrics()
+        self._pending = collections.deque()     # (request, offset, rows, submitTime) pieces
+        self._numPending = 0
+        self._hasWork = asyncio.Event()
+        # at most numSlots batches in flight; while the workers are busy the
+        # pending designs pile up, so batches grow with the load
+        self._slots = asyncio.Semaphore(numSlots)
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._dispatch())
+
+    async def stop(self):
+        if self._task != None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def evaluate(self, rows):
+        # records of a list of design rows, evaluated together with whatever else
+        # arrives within the window
+        startTime = time.time()
+        if not rows:
+            return []
+        request = {'future':asyncio.get_running_loop().create_future(), 'records':[None]*len(rows),
+                   'numRemaining':len(rows)}
+        for offset in range(0, len(rows), self.maxBatchSize):
+            piece = rows[offset:offset + self.maxBatchSize]
+            self._pending.append((request, offset, piece, startTime))
+            self._numPending += len(piece)
+        self._hasWork.set()
+        records = await request['future']
+        self.metrics.counts['requests'] += 1
+        self.metrics.add_latency('request', time.time() - startTime)
+        return records
+
+    async def _dispatch(self):
+        while True:
+            await self._hasWork.wait()
+            if self._numPending < self.maxBatchSize:
+                await asyncio.sleep(self.window)
+            await self._slots.acquire()
+            batch = []
+            numRows = 0
+            while self._pending and numRows + len(self._pending[0][2]) <= self.maxBatchSize:
+                piece = self._pending.popleft()
+                batch.append(piece)
+                numRows += len(piece[2])
+            self._numPending -= numRows
+            if not self._pending:
+                self._hasWork.clear()
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        try:
+            dispatchTime = time.time()
+            rows = []
+            for request, offset, piece, submitTime in batch:
+                rows.extend(piece)
+                self.metrics.add_latency('queue', dispatchTime - submitTime)
+            try:
+                records = await asyncio.get_running_loop().run_in_executor(self.executor, evaluate_rows, rows)
+            except Exception as e:
+                for request, offset, piece, submitTime in batch:
+                    if not request['future'].done():
+                        request['future'].set_exception(e)
+                return
+            self.metrics.add_latency('evaluate', time.time() - dispatchTime)
+            self.metrics.add_batch(len(rows), sum(1 for record in records if 'error' in record))
+            start = 0
+            for request, offset, piece, submitTime in batch:
+                request['records'][offset:offset + len(piece)] = records[start:start + len(piece)]
+                start += len(piece)
+                request['numRemaining'] -= len(piece)
+                if request['numRemaining'] == 0 and not request['future'].done():
+                    request['future'].set_result(request['records'])
+        finally:
+            self._slots.release()
+
+
+class EvaluationServer(object):
+    """HTTP/JSON front end of a MicroBatcher, on a TCP port or a Unix socket"""
+
+    def __init__(self, numWorkers = 1, window = DEFAULT_WINDOW, maxBatchSize = DEFAULT_MAX_BATCH_SIZE):
+        # numWorkers processes evaluate the batches, 0 evaluates in a thread of
+        # the server process
+        self.numWorkers = numWorkers
+        self.window = window
+        self.maxBatchSize = maxBatchSize
+        self.metrics = ServerMetrics()
+        self.executor = None
+        self.batcher = None
+        self.server = None
+        self._writers = set()       # open connections, closed on stop
+
+    async def start(self, host = '127.0.0.1', port = DEFAULT_PORT, path = None):
+        # listen on host:port, or on the Unix socket path when given; port 0 picks a free port
+        warm_up()
+        if self.numWorkers > 0:
+            # spawned rather than forked, so the workers do not hold copies of the
+            # sockets; started up front so the first requests do not wait for them
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.numWorkers, multiprocessing.get_context('spawn'), initializer=warm_up)
+            await asyncio.gather(*[asyncio.get_running_loop().run_in_executor(self.executor, warm_up)
+                                   for n in range(self.numWorkers)])
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.batcher = MicroBatcher(self.executor, max(self.numWorkers, 1), self.window,
+                                    self.maxBatchSize, self.metrics)
+        self.batcher.start()
+        if path != None:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    def get_address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def stop(self):
+        self.server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+        self.executor.shutdown()
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive, one request at a time per connection
+        self._writers.add(writer)
+        try:
+            while True:
+                request = await read_http_request(reader)
+                if request == None:
+                    break
+                method, target, headers, body = request
+                status, response = await self.handle_request(method, target, body)
+                if status >= 400:
+                    self.metrics.counts['httpErrors'] += 1
+                keepAlive = headers.get('connection', '').lower() != 'close'
+                write_http_response(writer, status, response, keepAlive)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            self.metrics.counts['httpErrors'] += 1
+            write_http_response(writer, 400, {'error':str(e)}, False)
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def handle_request(self, method, target, body):
+        # (status, JSON response) of one request
+        path = target.split('?')[0]
+        if path == '/evaluate':
+            if method != 'POST':
+                return 405, {'error':'use POST'}
+            try:
+                designs = json.loads(body.decode('utf-8'))
+            except ValueError as e:
+                return 400, {'error':'invalid JSON: {0}'.format(e)}
+            if isinstance(designs, dict):
+                return 200, (await self.batcher.evaluate([designs]))[0]
+            if isinstance(designs, list) and all(isinstance(row, dict) for row in designs):
+                return 200, await self.batcher.evaluate(designs)
+            return 400, {'error':'expected a design object or a list of them'}
+        if path == '/metrics':
+            return 200, self.metrics.get_summary()
+        if path == '/health':
+            return 200, {'status':'ok'}
+        return 404, {'error':'unknown path: {0}'.format(path)}
+
+
+async def read_http_request(reader):
+    # (method, target, headers, body) of the next request, None at end of stream
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError('malformed request line')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_SIZE:
+        raise ValueError('request body too large')
+    body = await reader.readexactly(length) if length else b''
+    return parts[0], parts[1], headers, body
+
+
+def write_http_response(writer, status, response, keepAlive):
+    body = json.dumps(response, sort_keys=True).encode('utf-8')
+    header = 'HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n{3}\r\n'.format(
+        status, http.client.responses.get(status, ''), len(body),
+        'Connection: keep-alive\r\n' if keepAlive else 'Connection: close\r\n')
+    writer.write(header.encode('latin-1') + body)
+
+
+def evaluate_remote(designs, host = '127.0.0.1', port = DEFAULT_PORT, timeout = 60):
+    # client side: evaluate one design dict or a list of them on a running server
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('POST', '/evaluate', json.dumps(designs), {'Content-Type':'application/json'})
+        response = connection.getresponse()
+        result = json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise ValueError(result.get('error', 'HTTP {0}'.format(response.status)))
+    return result
+
+
+async def serve(host, port, path, numWorkers, window, maxBatchSize):
+    server = EvaluationServer(numWorkers, window, maxBatchSize)
+    await server.start(host, port, path)
+    sys.stderr.write('listening on {0}\n'.format(path or '{0}:{1}'.format(*server.get_address()[:2])))
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    """ Long running local evaluation service
+            Keeps the material and coolant data loaded and evaluates designs posted as
+            JSON, coalescing concurrent requests into batches.
+        Run command examples:
+            ./microchannel_server.py --port 8765 -j 4
+            curl -d '{"name": "LSEpiTip", "flowRate": 300}' localhost:8765/evaluate
+            curl localhost:8765/metrics
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve microchannel design evaluations over HTTP/JSON')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', default=None, help='Unix socket path instead of TCP')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='worker processes, 0 for a thread')
+    parser.add_argument('--window-ms', type=float, default=DEFAULT_WINDOW*1e3, help='micro-batch window')
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.workers, args.window_ms*1e-3, args.max_batch))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+from __future__ import division
+import collections
+import csv
+import json
+import multiprocessing
+import sys
+import numpy as np
+import microchannel as mc
+import microchannel_batch as mb
+import coolant_properties as cpp
+from thermal_properties import get_material_registry
+
+
+PROPERTY_KEYS = ('channelWidth', 'channelHeight', 'channelLength', 'baseThickness', 'wallThickness',
+                 'numSplits', 'numChannelsPerSplit', 'sourceWidth', 'sourceArea', 'flowMode',
+                 'flowRate', 'pressure', 'headloss', 'nuInf', 'thermalMaterialName', 'coolantName',
+                 'coolantT', 'concPercent')
+TEXT_KEYS = ('name', 'flowMode', 'thermalMaterialName', 'coolantName')
+
+
+def read_rows(f, fileFormat):
+    # yield (lineNumber, row, error) for every design row of a CSV or JSONL stream
+    if fileFormat == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            # DictReader keeps the fields beyond the header under the key None
+            hasExtraFields = None in row
+            row = dict((key, value) for key, value in row.items() if key != None and value not in ('', None))
+            if hasExtraFields:
+                yield reader.line_num, row, 'too many fields'
+                continue
+            yield reader.line_num, row, None
+    else:
+        for lineNumber, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError('row is not a JSON object')
+            except ValueError as e:
+                yield lineNumber, None, 'invalid JSON: {0}'.format(e)
+                continue
+            yield lineNumber, row, None
+
+
+def iter_chunks(rows, chunkSize):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_design_properties(row):
+    # complete microchannelProperties for a row, a preset 'name' supplies the defaults
+    properties = {}
+    if 'name' in row:
+        preset = mc.get_preset_properties(row['name'])
+        if preset != None:
+            properties.update(preset)
+    properties.update(row)
+    missing = [key for key in PROPERTY_KEYS if key not in properties and key != 'concPercent']
+    if missing:
+        raise ValueError('missing {0}'.format(', '.join(missing)))
+    for key in PROPERTY_KEYS:
+        if key not in TEXT_KEYS and properties.get(key) != None:
+            properties[key] = float(properties[key])
+    return properties
+
+
+def evaluate_chunk(chunk):
+    # evaluate one chunk of (lineNumber, row, error) tuples, return output records in order
+    registry = get_material_registry()
+    records = [None]*len(chunk)
+    valid = []
+    columns = dict((key, []) for key in PROPERTY_KEYS)
+    columns['wallK'] = []
+    for n, (lineNumber, row, error) in enumerate(chunk):
+        if error == None:
+            try:
+                properties = get_design_properties(row)
+                index = registry.get_index(properties['thermalMaterialName'])
+                if index == None:
+                    raise ValueError('unknown thermal material: {0}'.format(properties['thermalMaterialName']))
+                if properties['coolantName'].lower() not in ('air', 'water', 'egw'):
+                    raise ValueError('unknown coolant: {0}'.format(properties['coolantName']))
+                if properties['coolantName'].lower() == 'egw' and properties.get('concPercent') == None:
+                    raise ValueError('missing concPercent')
+            except (ValueError, TypeError, AttributeError) as e:
+                error = str(e)
+        if error != None:
+            records[n] = {'line':lineNumber}
+            records[n].update(row or {})
+            records[n]['error'] = error
+            continue
+        valid.append(n)
+        for key in PROPERTY_KEYS:
+            columns[key].append(properties.get(key))
+        columns['wallK'].append(registry.k[index])
+
+    if valid:
+        concPercent = np.array([0 if c == None else c for c in columns['concPercent']], dtype=float)
+        coolant = cpp.calc_coolant_properties_mixed(columns['coolantName'], columns['coolantT'], concPercent)
+        with np.errstate(all='ignore'):
+            perf = mb.calc_channel_perf_batch(
+                channelWidth=np.array(columns['channelWidth']), channelHeight=np.array(columns['channelHeight']),
+                channelLength=np.array(columns['channelLength']), baseThickness=np.array(columns['baseThickness']),
+                wallThickness=np.array(columns['wallThickness']), numSplits=np.array(columns['numSplits']),
+                numChannelsPerSplit=np.array(columns['numChannelsPerSplit']),
+                sourceWidth=np.array(columns['sourceWidth']), sourceArea=np.array(columns['sourceArea']),
+                flowMode=np.array(columns['flowMode']), flowRate=np.array(columns['flowRate']),
+                pressure=np.array(columns['pressure']), headloss=np.array(columns['headloss']),
+                nuInf=np.array(columns['nuInf']), wallK=np.array(columns['wallK']),
+                coolantK=coolant['k'], coolantMu=coolant['mu'], coolantRho=coolant['rho'],
+                coolantCp=coolant['cp'])
+        for i, n in enumerate(valid):
+            lineNumber, row, error = chunk[n]
+            record = {'line':lineNumber}
+            record.update(row)
+            for key in mb.CHANNEL_PERF_KEYS:
+                record[key] = float(perf[key][i])
+            if not np.isfinite(record['RTotal']):
+                record['error'] = 'non-finite result'
+            records[n] = record
+    return records
+
+
+def evaluate_chunks(chunks, numProcesses = 1, maxPending = None):
+    # evaluate chunks in input order, at most maxPending chunks are in flight
+    # so memory stays flat however long the input is
+    if numProcesses <= 1:
+        for chunk in chunks:
+            yield evaluate_chunk(chunk)
+        return
+
+    if maxPending == None:
+        maxPending = 2*numProcesses
+    pool = multiprocessing.Pool(numProcesses)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(evaluate_chunk, (chunk,)))
+            if len(pending) >= maxPending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class RecordWriter:
+    """Streams output records as CSV or JSONL"""
+
+    def __init__(self, f, fileFormat):
+        self.f = f
+        self.fileFormat = fileFormat
+        self.writer = None
+
+    def write(self, record):
+        if self.fileFormat == 'csv':
+            if self.writer == None:
+                # fixed columns, so a first record that failed to parse or lacks an
+                # optional input does not drop the columns of the later ones
+                fieldNames = ['line', 'name'] + list(PROPERTY_KEYS) + list(mb.CHANNEL_PERF_KEYS) + ['error']
+                self.writer = csv.DictWriter(self.f, fieldNames, extrasaction='ignore')
+                self.writer.writeheader()
+            self.writer.writerow(record)
+        else:
+            self.f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def run(inputFile, outputFile, inputFormat = 'jsonl', outputFormat = 'jsonl', chunkSize = 4096,
+        numProcesses = 1, errorFile = None):
+    # stream designs from inputFile to results in outputFile, return (numRows, numErrors)
+    writer = RecordWriter(outputFile, outputFormat)
+    numRows = 0
+    numErrors = 0
+    chunks = iter_chunks(read_rows(inputFile, inputFormat), chunkSize)
+    for records in evaluate_chunks(chunks, numProcesses):
+        for record in records:
+            numRows += 1
+            if 'error' in record:
+                numErrors += 1
+                if errorFile != None:
+                    errorFile.write('line {0}: {1}\n'.format(record['line'], record['error']))
+            writer.write(record)
+    return numRows, numErrors
+
+
+def get_file_format(fileName, fileFormat):
+    if fileFormat != None:
+        return fileFormat
+    if fileName != None and fileName.lower().endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+
+if __name__ == "__main__":
+    """ Streaming batch evaluation of microchannel designs
+            Each input row holds the microchannelProperties keys (channelWidth, ...,
+            thermalMaterialName, coolantName, coolantT, concPercent). A row may name
+            one of the predefined models in 'name' and override only some keys.
+            Results are written in input order with the channelPerf keys added;
+            rows that cannot be evaluated are reported on stderr and written with
+            an 'error' field.
+        Run command example:
+            ./microchannel_stream.py designs.csv -o results.jsonl -j 4
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Evaluate microchannel designs from CSV or JSONL')
+    parser.add_argument('input', nargs='?', default=None, help='input file, stdin if omitted')
+    parser.add_argument('-o', '--output', default=None, help='output file, stdout if omitted')
+    parser.add_argument('--input-format', choices=('csv', 'jsonl'), default=None)
+    parser.add_argument('--output-format', choices=('csv', 'jsonl'), default=None)
+    parser.add_argument('-c', '--chunk-size', type=int, default=4096)
+    parser.add_argument('-j', '--processes', type=int, default=1)
+    args = parser.parse_args()
+
+    inputFile = open(args.input, 'r') if args.input else sys.stdin
+    outputFile = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        numRows, numErrors = run(inputFile, outputFile,
+                                 get_file_format(args.input, args.input_format),
+                                 get_file_format(args.output, args.output_format),
+                                 args.chunk_size, args.processes, sys.stderr)
+    finally:
+        if args.input:
+            inputFile.close()
+        if args.output:
+            outputFile.close()
+    sys.stderr.write('{0} rows, {1} errors\n'.format(numRows, numErrors))
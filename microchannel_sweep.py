@@ -0,0 +1,284 @@
+#!/usr/bin/python
+from __future__ import division
+import json
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import microchannel as mc
+import microchannel_batch as mb
+import microchannel_designs as md
+
+
+MANIFEST_FILE_NAME = 'manifest.json'
+SHARD_FILE_NAME = 'chunk_{0:06d}.npy'
+SWEEP_VERSION = 1
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def expand_values(key, values):
+    # values of one swept key: a list, a scalar, or a range
+    # {'start':a, 'stop':b, 'num':n} with an optional 'scale':'log'
+    if isinstance(values, dict):
+        if values.get('scale', 'linear') == 'log':
+            values = np.geomspace(values['start'], values['stop'], int(values['num']))
+        else:
+            values = np.linspace(values['start'], values['stop'], int(values['num']))
+    elif not isinstance(values, (list, tuple, np.ndarray)):
+        values = [values]
+    if key in md.DESIGN_TEXT_KEYS:
+        return [str(value) for value in values]
+    return [float(value) for value in values]
+
+
+class SweepPlan(object):
+    """Full factorial sweep over microchannelProperties keys around a base design,
+    expanded lazily a chunk at a time; the last swept key varies fastest"""
+
+    def __init__(self, base, sweep, chunkSize = DEFAULT_CHUNK_SIZE):
+        # base is a preset name or a microchannelProperties dict, sweep maps keys
+        # to the values accepted by expand_values
+        if not isinstance(base, dict):
+            properties = mc.get_preset_properties(base)
+            if properties == None:
+                raise ValueError('unknown preset: {0}'.format(base))
+            base = properties
+        for key in sweep:
+            if key not in md.DESIGN_KEYS:
+                raise ValueError('unknown design property: {0}'.format(key))
+        self.base = dict((key, base.get(key)) for key in md.DESIGN_KEYS)
+        self.keys = tuple(key for key in md.DESIGN_KEYS if key in sweep)
+        self.values = dict((key, expand_values(key, sweep[key])) for key in self.keys)
+        self.shape = tuple(len(self.values[key]) for key in self.keys)
+        self.chunkSize = int(chunkSize)
+        self.numDesigns = int(np.prod(self.shape, dtype=np.int64))
+        self.numChunks = -(-self.numDesigns//self.chunkSize)
+        # shard rows are the swept keys, text keys as codes into their values, then channelPerf
+        self.columns = self.keys + mb.CHANNEL_PERF_KEYS
+
+    def get_spec(self):
+        # JSON description of the plan, also used to recognise a run on resume
+        return {'version':SWEEP_VERSION, 'base':self.base, 'chunkSize':self.chunkSize,
+                'sweep':dict((key, self.values[key]) for key in self.keys)}
+
+    def get_levels(self):
+        return dict((key, list(self.values[key])) for key in self.keys if key in md.DESIGN_TEXT_KEYS)
+
+    def get_chunk_codes(self, chunkIndex):
+        # per swept key, the value index of every design of one chunk
+        start = chunkIndex*self.chunkSize
+        flat = np.arange(start, min(start + self.chunkSize, self.numDesigns), dtype=np.int64)
+        if not self.keys:
+            return {}
+        return dict(zip(self.keys, np.unravel_index(flat, self.shape)))
+
+    def get_designs(self, codes):
+        # DesignSet of the designs given by value indices of the swept keys
+        n = len(codes[self.keys[0]]) if self.keys else 1
+        columns = {}
+        levels = {}
+        for key in md.DESIGN_KEYS:
+            if key in codes and key in md.DESIGN_TEXT_KEYS:
+                columns[key] = codes[key]
+                levels[key] = self.values[key]
+            elif key in codes:
+                columns[key] = np.array(self.values[key])[codes[key]]
+            elif key in md.DESIGN_TEXT_KEYS:
+                columns[key] = np.zeros(n, dtype=np.uint8)
+                levels[key] = [self.base[key]]
+            else:
+                columns[key] = np.full(n, np.nan if self.base[key] == None else self.base[key])
+        return md.DesignSet(columns, levels)
+
+    def get_chunk_designs(self, chunkIndex):
+        return self.get_designs(self.get_chunk_codes(chunkIndex))
+
+
+def evaluate_sweep_chunk(plan, outputDir, chunkIndex):
+    # process pool worker: evaluate one chunk and write its shard, a
+    # (numColumns, numDesigns) float64 array so every column is contiguous; the
+    # shard is renamed into place only when complete
+    startTime = time.time()
+    codes = plan.get_chunk_codes(chunkIndex)
+    designs = plan.get_designs(codes)
+    with np.errstate(all='ignore'):
+        perf = designs.evaluate()
+    shard = np.empty((len(plan.columns), len(designs)))
+    for n, key in enumerate(plan.keys):
+        shard[n] = codes[key] if key in md.DESIGN_TEXT_KEYS else designs.columns[key]
+    for n, key in enumerate(mb.CHANNEL_PERF_KEYS):
+        shard[len(plan.keys) + n] = perf.columns[key]
+    fileName = os.path.join(outputDir, SHARD_FILE_NAME.format(chunkIndex))
+    tmpFileName = '{0}.{1}.tmp'.format(fileName, os.getpid())
+    with open(tmpFileName, 'wb') as f:
+        np.save(f, shard)
+    os.rename(tmpFileName, fileName)
+    numInvalid = int(len(designs) - np.count_nonzero(np.isfinite(perf.columns['RTotal'])))
+    return chunkIndex, len(designs), numInvalid, time.time() - startTime
+
+
+def evaluate_sweep_chunk_star(args):
+    return evaluate_sweep_chunk(*args)
+
+
+def read_manifest(outputDir):
+    fileName = os.path.join(outputDir, MANIFEST_FILE_NAME)
+    if not os.path.exists(fileName):
+        return None
+    with open(fileName, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(outputDir, manifest):
+    # replace the manifest atomically, an interrupted write leaves the old one
+    fileName = os.path.join(outputDir, MANIFEST_FILE_NAME)
+    tmpFileName = '{0}.{1}.tmp'.format(fileName, os.getpid())
+    with open(tmpFileName, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(tmpFileName, fileName)
+
+
+def check_plan(plan):
+    # fail before the run starts on materials or coolants that cannot be evaluated
+    for key in ('thermalMaterialName', 'coolantName'):
+        for n in range(len(plan.values.get(key, [plan.base[key]]))):
+            codes = dict((k, np.zeros(1, dtype=np.intp)) for k in plan.keys)
+            if key in codes:
+                codes[key][0] = n
+            plan.get_designs(codes).get_batch_columns()
+
+
+def format_progress(numCompleted, numTotal, numNew, numDesigns, elapsed):
+    # rate and remaining time are from the numNew chunks of this run, a resumed
+    # run does not count the chunks done before
+    rate = numDesigns/elapsed if elapsed > 0 else 0.0
+    remaining = (numTotal - numCompleted)*elapsed/numNew if numNew else float('nan')
+    return 'chunk {0}/{1}  {2} designs  {3:.4g} designs/s  {4:.1f} s elapsed  {5:.1f} s left\n'.format(
+        numCompleted, numTotal, numDesigns, rate, elapsed, remaining)
+
+
+def run_sweep(outputDir, base, sweep, chunkSize = DEFAULT_CHUNK_SIZE, numProcesses = 1,
+              progress = None, maxChunks = None):
+    # Evaluate a full factorial sweep (see SweepPlan) into outputDir as one .npy
+    # shard per chunk plus manifest.json. The manifest is rewritten after every
+    # finished chunk, so a run that is interrupted and started again with the same
+    # arguments skips the chunks already done. progress is an optional stream for
+    # a line per chunk; maxChunks stops after that many new chunks.
+    # Returns a summary dict with the counts and the throughput of this run.
+    startTime = time.time()
+    plan = SweepPlan(base, sweep, chunkSize)
+    if not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+    manifest = read_manifest(outputDir)
+    if manifest != None and manifest['spec'] != json.loads(json.dumps(plan.get_spec())):
+        raise ValueError('{0} holds a different sweep'.format(outputDir))
+    if manifest == None:
+        check_plan(plan)
+        manifest = {'spec':plan.get_spec(), 'columns':list(plan.columns), 'levels':plan.get_levels(),
+                    'numDesigns':plan.numDesigns, 'numChunks':plan.numChunks,
+                    'completed':{}, 'numInvalid':0}
+        write_manifest(outputDir, manifest)
+
+    # completed maps chunk index (as text, for JSON) to its number of designs
+    todo = [n for n in range(plan.numChunks) if str(n) not in manifest['completed']]
+    if maxChunks != None:
+        todo = todo[:maxChunks]
+    tasks = ((plan, outputDir, n) for n in todo)
+    numDesigns = 0
+    numNew = 0
+    if numProcesses > 1 and len(todo) > 1:
+        pool = multiprocessing.Pool(min(numProcesses, len(todo)))
+        results = pool.imap_unordered(evaluate_sweep_chunk_star, tasks)
+    else:
+        pool = None
+        results = (evaluate_sweep_chunk(*task) for task in tasks)
+    try:
+        for chunkIndex, n, numInvalid, chunkTime in results:
+            manifest['completed'][str(chunkIndex)] = n
+            manifest['numInvalid'] += numInvalid
+            write_manifest(outputDir, manifest)
+            numDesigns += n
+            numNew += 1
+            if progress != None:
+                progress.write(format_progress(len(manifest['completed']), plan.numChunks, numNew,
+                                               numDesigns, time.time() - startTime))
+                progress.flush()
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.time() - startTime
+    return {'numChunks':plan.numChunks, 'numCompleted':len(manifest['completed']),
+            'numDesigns':numDesigns, 'numInvalid':manifest['numInvalid'], 'wallTime':elapsed,
+            'throughput':numDesigns/elapsed if elapsed > 0 else 0.0}
+
+
+class SweepResults(object):
+    """Read access to the shards of a sweep, memory-mapped a chunk at a time"""
+
+    def __init__(self, outputDir):
+        self.outputDir = outputDir
+        self.manifest = read_manifest(outputDir)
+        if self.manifest == None:
+            raise ValueError('no sweep manifest in {0}'.format(outputDir))
+        spec = self.manifest['spec']
+        self.plan = SweepPlan(spec['base'], spec['sweep'], spec['chunkSize'])
+        self.columns = tuple(self.manifest['columns'])
+        self._rows = dict((key, n) for n, key in enumerate(self.columns))
+
+    def get_completed_chunks(self):
+        return sorted(int(n) for n in self.manifest['completed'])
+
+    def is_complete(self):
+        return len(self.manifest['completed']) == self.manifest['numChunks']
+
+    def get_shard(self, chunkIndex):
+        # (numColumns, numDesigns) array of one chunk, memory-mapped
+        fileName = os.path.join(self.outputDir, SHARD_FILE_NAME.format(chunkIndex))
+        return np.load(fileName, mmap_mode='r')
+
+    def get_chunk(self, chunkIndex):
+        # (DesignSet, ChannelPerfSet) of one chunk
+        shard = self.get_shard(chunkIndex)
+        designs = self.plan.get_chunk_designs(chunkIndex)
+        perf = md.ChannelPerfSet(dict((key, shard[self._rows[key]]) for key in mb.CHANNEL_PERF_KEYS))
+        return designs, perf
+
+    def iter_chunks(self):
+        for n in self.get_completed_chunks():
+            yield self.get_chunk(n)
+
+    def get_column(self, key):
+        # one swept key or channelPerf column over all completed chunks, in design
+        # order; text keys are returned as codes into manifest['levels'][key]
+        return np.concatenate([self.get_shard(n)[self._rows[key]] for n in self.get_completed_chunks()])
+
+
+if __name__ == "__main__":
+    """ Resumable full factorial sweep of microchannel designs
+            The spec file is JSON with a 'base' preset name or microchannelProperties
+            dict and a 'sweep' dict of keys to value lists or ranges, e.g.
+                {"base": "LSLaserBackplane",
+                 "sweep": {"channelWidth": {"start": 0.1, "stop": 1.0, "num": 100},
+                           "flowRate": {"start": 10, "stop": 1000, "num": 50, "scale": "log"},
+                           "thermalMaterialName": ["Cu", "Al"]}}
+            Running the same command again after an interruption continues the sweep.
+        Run command example:
+            ./microchannel_sweep.py spec.json -o sweep_out -j 8
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a resumable microchannel design sweep')
+    parser.add_argument('spec', help='JSON sweep spec')
+    parser.add_argument('-o', '--output', required=True, help='output directory')
+    parser.add_argument('-c', '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('-j', '--processes', type=int, default=1)
+    parser.add_argument('-q', '--quiet', action='store_true', help='no progress lines')
+    args = parser.parse_args()
+
+    with open(args.spec, 'r') as f:
+        spec = json.load(f)
+    summary = run_sweep(args.output, spec['base'], spec['sweep'], args.chunk_size, args.processes,
+                        None if args.quiet else sys.stderr)
+    sys.stdout.write(json.dumps(summary, sort_keys=True) + '\n')
@@ -0,0 +1,290 @@
+from __future__ import division
+import math
+import multiprocessing
+import time
+import numpy as np
+import microchannel_batch as mb
+
+
+TOLERANCE_KEYS = tuple(key for key in mb.BATCH_INPUT_KEYS if key != 'flowMode')
+DISTRIBUTION_KINDS = ('normal', 'uniform', 'triangular')
+DEFAULT_QUANTILES = (0.001, 0.01, 0.05, 0.5, 0.95, 0.99, 0.999)
+
+
+class StreamingStats(object):
+    """Mergeable running statistics of one output: count, mean, variance, min,
+    max, a histogram on fixed edges and a log-binned quantile sketch; the size
+    does not grow with the count"""
+
+    def __init__(self, relativeAccuracy = 0.005, edges = None):
+        self.relativeAccuracy = relativeAccuracy
+        self.edges = None if edges is None else np.asarray(edges, dtype=float)
+        # samples below, between and above the edges
+        self.histogram = None if edges is None else np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.logGamma = math.log((1 + relativeAccuracy)/(1 - relativeAccuracy))
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0           # sum of squared deviations from the mean
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.positive = {}      # bin index -> count, bin i holds (gamma^(i-1), gamma^i]
+        self.negative = {}      # same for -x
+        self.zeros = 0
+
+    def add(self, x):
+        # add an array of finite values
+        x = np.asarray(x, dtype=float).ravel()
+        n = len(x)
+        if n == 0:
+            return
+        mean = x.mean()
+        m2 = ((x - mean)**2).sum()
+        self._merge_moments(n, mean, m2)
+        self.min = min(self.min, x.min())
+        self.max = max(self.max, x.max())
+        self.zeros += int(np.count_nonzero(x == 0))
+        self._add_bins(self.positive, x[x > 0])
+        self._add_bins(self.negative, -x[x < 0])
+        if self.edges is not None:
+            self.histogram += np.bincount(np.searchsorted(self.edges, x, side='right'),
+                                          minlength=len(self.histogram))
+
+    def _add_bins(self, bins, x):
+        if len(x) == 0:
+            return
+        index, counts = np.unique(np.ceil(np.log(x)/self.logGamma).astype(np.int64), return_counts=True)
+        for i, c in zip(index.tolist(), counts.tolist()):
+            bins[i] = bins.get(i, 0) + c
+
+    def _merge_moments(self, n, mean, m2):
+        # Chan et al. pairwise update of count, mean and squared deviations
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta*n/total
+        self.m2 += m2 + delta*delta*self.count*n/total
+        self.count = total
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.zeros += other.zeros
+        if self.edges is not None:
+            self.histogram += other.histogram
+        for bins, otherBins in ((self.positive, other.positive), (self.negative, other.negative)):
+            for i, c in otherBins.items():
+                bins[i] = bins.get(i, 0) + c
+
+    def get_variance(self):
+        return self.m2/(self.count - 1) if self.count > 1 else float('nan')
+
+    def get_bins(self):
+        # (values, counts) of the sketch in increasing order, each bin represented
+        # by a value within relativeAccuracy of everything it holds
+        gamma = math.exp(self.logGamma)
+        values = []
+        counts = []
+        for i in sorted(self.negative, reverse=True):
+            values.append(-2*gamma**i/(gamma + 1))
+            counts.append(self.negative[i])
+        if self.zeros:
+            values.append(0.0)
+            counts.append(self.zeros)
+        for i in sorted(self.positive):
+            values.append(2*gamma**i/(gamma + 1))
+            counts.append(self.positive[i])
+        return np.array(values), np.array(counts)
+
+    def get_quantiles(self, quantiles = DEFAULT_QUANTILES):
+        # quantile estimates within relativeAccuracy, clamped to the exact min and max
+        if self.count == 0:
+            return [float('nan')]*len(quantiles)
+        values, counts = self.get_bins()
+        cumulative = np.cumsum(counts)
+        ranks = np.asarray(quantiles)*(self.count - 1)
+        index = np.searchsorted(cumulative, ranks, side='right')
+        return np.clip(values[np.minimum(index, len(values) - 1)], self.min, self.max).tolist()
+
+    def get_histogram(self, edges = None):
+        # sample counts between edges; exact on the edges given at construction
+        # (without the under- and overflow counts), otherwise binned from the sketch;
+        # empty when there are no edges at all
+        if edges is None:
+            if self.histogram is None:
+                return np.zeros(0, dtype=np.int64)
+            return self.histogram[1:-1].copy()
+        values, counts = self.get_bins()
+        return np.histogram(values, bins=edges, weights=counts)[0].astype(np.int64)
+
+    def get_summary(self, quantiles = DEFAULT_QUANTILES):
+        summary = {'count':self.count, 'mean':self.mean, 'std':math.sqrt(self.get_variance()),
+                   'min':self.min, 'max':self.max}
+        summary['quantiles'] = dict(zip(quantiles, self.get_quantiles(quantiles)))
+        return summary
+
+
+class ToleranceStats(object):
+    """Streaming statistics and spec yield of one tolerance run or chunk of it"""
+
+    def __init__(self, outputs, specLimits = None, relativeAccuracy = 0.005, histogramEdges = None):
+        self.outputs = tuple(outputs)
+        self.specLimits = dict(specLimits or {})    # output -> (low, high), either may be None
+        self.numSamples = 0
+        self.numInvalid = 0     # samples with a non-finite output
+        self.numPassed = 0      # samples within every spec limit
+        self.numPassedByOutput = dict((key, 0) for key in self.specLimits)
+        self.stats = dict((key, StreamingStats(relativeAccuracy, (histogramEdges or {}).get(key)))
+                          for key in self.outputs)
+
+    def add(self, perf):
+        valid = np.ones(np.shape(perf[self.outputs[0]]), dtype=bool)
+        for key in self.outputs:
+            valid &= np.isfinite(perf[key])
+        passed = valid.copy()
+        for key in self.specLimits:
+            low, high = self.specLimits[key]
+            inside = valid.copy()
+            if low != None:
+                inside &= (perf[key] >= low)
+            if high != None:
+                inside &= (perf[key] <= high)
+            self.numPassedByOutput[key] += int(np.count_nonzero(inside))
+            passed &= inside
+        self.numSamples += valid.size
+        self.numInvalid += int(valid.size - np.count_nonzero(valid))
+        self.numPassed += int(np.count_nonzero(passed))
+        for key in self.outputs:
+            self.stats[key].add(perf[key][valid])
+
+    def merge(self, other):
+        self.numSamples += other.numSamples
+        self.numInvalid += other.numInvalid
+        self.numPassed += other.numPassed
+        for key in self.numPassedByOutput:
+            self.numPassedByOutput[key] += other.numPassedByOutput[key]
+        for key in self.outputs:
+            self.stats[key].merge(other.stats[key])
+
+    def get_yield(self):
+        return self.numPassed/self.numSamples if self.numSamples else float('nan')
+
+    def get_summary(self, quantiles = DEFAULT_QUANTILES):
+        summary = {'numSamples':self.numSamples, 'numInvalid':self.numInvalid, 'yield':self.get_yield()}
+        summary['yieldByOutput'] = dict((key, self.numPassedByOutput[key]/self.numSamples if self.numSamples
+                                         else float('nan')) for key in self.numPassedByOutput)
+        summary['outputs'] = dict((key, self.stats[key].get_summary(quantiles)) for key in self.outputs)
+        return summary
+
+
+def check_distributions(distributions):
+    # distributions maps inputs to ('normal', sigma), ('uniform', halfWidth) or
+    # ('triangular', halfWidth), in the units of the input, around its nominal value
+    for key in distributions:
+        if key not in TOLERANCE_KEYS:
+            raise ValueError('unknown tolerance input: {0}'.format(key))
+        if distributions[key][0] not in DISTRIBUTION_KINDS:
+            raise ValueError('unknown distribution: {0}'.format(distributions[key][0]))
+
+
+def draw_samples(rng, nominal, distributions, n):
+    # n random variations of the nominal inputs
+    samples = {}
+    for key in sorted(distributions):
+        kind, width = distributions[key][:2]
+        if kind == 'normal':
+            offset = width*rng.standard_normal(n)
+        elif kind == 'uniform':
+            offset = rng.uniform(-width, width, n)
+        else:
+            offset = rng.triangular(-width, 0, width, n)
+        samples[key] = nominal[key] + offset
+    return samples
+
+
+def evaluate_samples(nominal, distributions, seed, chunkIndex, numSamples):
+    # draw and evaluate one chunk; every chunk has its own random stream so the
+    # results do not depend on how chunks are spread over processes
+    rng = np.random.RandomState([seed, chunkIndex])
+    columns = dict(nominal)
+    columns.update(draw_samples(rng, nominal, distributions, numSamples))
+    with np.errstate(all='ignore'):
+        return mb.calc_channel_perf_batch(**columns)
+
+
+def get_histogram_edges(perf, outputs, numBins):
+    # histogram edges per output around the spread of a pilot sample, the range is
+    # widened by half on both sides and samples beyond it are counted as overflow
+    edges = {}
+    for key in outputs:
+        values = perf[key][np.isfinite(perf[key])]
+        if len(values) == 0:
+            continue
+        low, high = np.percentile(values, [0.1, 99.9])
+        margin = max(high - low, 1e-9*max(abs(low), abs(high), 1e-300))/2
+        edges[key] = np.linspace(low - margin, high + margin, numBins + 1)
+    return edges
+
+
+def evaluate_tolerance_chunk(nominal, distributions, outputs, specLimits, relativeAccuracy,
+                             histogramEdges, seed, chunkIndex, numSamples):
+    # process pool worker, the ToleranceStats of one chunk
+    perf = evaluate_samples(nominal, distributions, seed, chunkIndex, numSamples)
+    stats = ToleranceStats(outputs, specLimits, relativeAccuracy, histogramEdges)
+    stats.add(perf)
+    return stats
+
+
+def evaluate_tolerance_chunk_star(args):
+    return evaluate_tolerance_chunk(*args)
+
+
+def run_tolerance_analysis(model, distributions, numSamples = 1000000, specLimits = None,
+                           outputs = ('RTotal', 'P'), chunkSize = 65536, numProcesses = None,
+                           seed = 0, relativeAccuracy = 0.005, histogramEdges = None,
+                           numHistogramBins = 100):
+    # Monte Carlo manufacturing tolerance analysis of a Microchannel.
+    #   distributions   input -> ('normal', sigma) | ('uniform', halfWidth) | ('triangular', halfWidth),
+    #                   e.g. {'channelWidth':('normal', 0.01), 'wallThickness':('uniform', 0.02)}
+    #   specLimits      output -> (low, high) for the yield, either limit may be None
+    #   histogramEdges  output -> bin edges, by default numHistogramBins bins placed
+    #                   from a pilot sample
+    # Samples are drawn and evaluated in chunks spread across a process pool and
+    # reduced into streaming statistics, so memory does not grow with numSamples.
+    # Chunk k always uses the random stream (seed, k), a run is reproducible for
+    # any numProcesses.
+    startTime = time.time()
+    check_distributions(distributions)
+    nominal = mb.get_batch_columns([model])
+    for key in nominal:
+        nominal[key] = nominal[key][0]
+    outputs = tuple(outputs) + tuple(key for key in (specLimits or {}) if key not in outputs)
+
+    if histogramEdges == None:
+        pilot = evaluate_samples(nominal, distributions, seed, 0, min(chunkSize, numSamples, 4096))
+        histogramEdges = get_histogram_edges(pilot, outputs, numHistogramBins)
+
+    numChunks = -(-numSamples//chunkSize)
+    tasks = ((nominal, distributions, outputs, specLimits, relativeAccuracy, histogramEdges, seed, n,
+              min(chunkSize, numSamples - n*chunkSize)) for n in range(numChunks))
+    if numProcesses == None:
+        numProcesses = multiprocessing.cpu_count()
+    stats = ToleranceStats(outputs, specLimits, relativeAccuracy, histogramEdges)
+    if numProcesses > 1 and numChunks > 1:
+        pool = multiprocessing.Pool(min(numProcesses, numChunks))
+        try:
+            for chunkStats in pool.imap(evaluate_tolerance_chunk_star, tasks):
+                stats.merge(chunkStats)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            stats.merge(evaluate_tolerance_chunk(*task))
+
+    result = stats.get_summary()
+    result['stats'] = stats
+    result['nominal'] = model.calc_channel_perf()
+    result['wallTime'] = time.time() - startTime
+    return result
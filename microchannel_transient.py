@@ -0,0 +1,146 @@
+from __future__ import division
+import numpy as np
+import scipy.signal
+import microchannel_batch as mb
+
+
+# Lumped transient model of a cold plate, a three node Cauer ladder from the
+# heat source to the coolant inlet:
+#   source node   half the base mass, joined to the fin node by RCond
+#   fin node      the other half of the base and the channel walls, joined to the
+#                 coolant node by RConv
+#   coolant node  the coolant held in the channels, joined to the inlet by RHeat
+# The steady state rise of the source node is power*RTotal like calc_channel_perf.
+NUM_NODES = 3
+
+
+def calc_rc_network(channelWidth, channelHeight, channelLength, baseThickness, wallThickness,
+                    numSplits, numChannelsPerSplit, sourceArea, RCond, RConv, RHeat, wallRho,
+                    wallCp, coolantRho, coolantCp):
+    # resistances [C/W] and heat capacities [J/C] of the ladder, arrays of shape
+    # (..., NUM_NODES) broadcast over the inputs
+    baseC = wallRho*wallCp*sourceArea*(baseThickness*1e-1)
+    wallC = wallRho*wallCp*numSplits*numChannelsPerSplit*wallThickness*channelHeight*channelLength*1e-3
+    coolantC = coolantRho*coolantCp*numSplits*numChannelsPerSplit*channelWidth*channelHeight*channelLength*1e-3
+    values = np.broadcast_arrays(RCond, RConv, RHeat, baseC/2, baseC/2 + wallC, coolantC)
+    return np.stack(values[:NUM_NODES], axis=-1), np.stack(values[NUM_NODES:], axis=-1)
+
+
+def get_foster_network(R, C):
+    # Foster (modal) form of the ladder seen from the source node: the rise for a
+    # power step is sum(RFoster*(1 - exp(-t/tau))). Returns (RFoster [C/W], tau [s]),
+    # each of shape (..., NUM_NODES) with the modes in order of decreasing tau.
+    R = np.asarray(R, dtype=float)
+    C = np.asarray(C, dtype=float)
+    if not np.all(C > 0):
+        raise ValueError('heat capacities must be positive, check the wall material rho and cp')
+    g = 1/R
+    G = np.zeros(R.shape + (NUM_NODES,))
+    for n in range(NUM_NODES):
+        G[..., n, n] = g[..., n] + (g[..., n - 1] if n > 0 else 0)
+        if n > 0:
+            G[..., n, n - 1] = -g[..., n - 1]
+            G[..., n - 1, n] = -g[..., n - 1]
+    # symmetric form C^-1/2 G C^-1/2, its eigenvectors give the modal weights
+    scale = 1/np.sqrt(C)
+    eigenvalues, eigenvectors = np.linalg.eigh(G*scale[..., :, None]*scale[..., None, :])
+    RFoster = eigenvectors[..., 0, :]**2/(C[..., :1]*eigenvalues)
+    return RFoster, 1/eigenvalues
+
+
+def calc_thermal_impedance(RFoster, tau, t):
+    # step response [C/W] of networks (..., NUM_NODES) at times t [s], shape (..., len(t))
+    t = np.asarray(t, dtype=float)
+    return (RFoster[..., None]*-np.expm1(-t/tau[..., None])).sum(axis=-2)
+
+
+def calc_transient_response(RFoster, tau, power, dt, initialPower = 0.0):
+    # Source temperature rise over the coolant inlet [C] for power waveforms [W]
+    # sampled every dt [s]. power[..., n] is held over the n-th step and the rise is
+    # returned at the end of each step; every mode is a first order filter that
+    # is integrated exactly, so dt may be as coarse as the waveform allows.
+    #   RFoster, tau    networks of shape (numNetworks, NUM_NODES), get_foster_network
+    #   power           (numSteps,) or (numWaveforms, numSteps) shared by all networks,
+    #                   or (numNetworks, numWaveforms, numSteps)
+    #   initialPower    start from the steady state at this power [W], scalar or
+    #                   per waveform
+    # Returns an array of shape (numNetworks, numWaveforms, numSteps).
+    RFoster = np.atleast_2d(RFoster)
+    tau = np.atleast_2d(tau)
+    power = np.asarray(power, dtype=float)
+    while power.ndim < 3:
+        power = power[None]
+    numNetworks = len(RFoster)
+    numWaveforms, numSteps = power.shape[-2:]
+    if len(power) not in (1, numNetworks):
+        raise ValueError('power has {0} networks, expected 1 or {1}'.format(len(power), numNetworks))
+    initialPower = np.broadcast_to(np.asarray(initialPower, dtype=float), (numWaveforms,))
+
+    # Every mode is y[i] = a*y[i - 1] + RFoster*(1 - a)*power[i], started from
+    # y = RFoster*initialPower, i.e. RFoster*(1 - a) times the power filtered by
+    # 1/(1 - a z^-1) from the state initialPower/(1 - a), which only depends on the
+    # pole. lfilter runs the filter along the time axis in C, once per distinct
+    # pole of a mode for all networks with that pole and all their waveforms; a
+    # power waveform shared by the networks is filtered once per pole.
+    a = np.exp(-dt/tau)
+    b = RFoster*(1 - a)
+    initialState = initialPower[:, None]
+    rise = np.zeros((numNetworks, numWaveforms, numSteps))
+    for k in range(RFoster.shape[1]):
+        # networks grouped by pole, rows of a group are contiguous in order
+        order = np.argsort(a[:, k], kind='mergesort')
+        poles, starts = np.unique(a[order, k], return_index=True)
+        for pole, rows in zip(poles, np.split(order, starts[1:])):
+            zi = (pole/(1 - pole))*initialState
+            if len(rows) == 1:
+                n = rows[0]
+                gain = b[n, k]
+                rise[n] += scipy.signal.lfilter([gain], [1.0, -pole], power[0 if len(power) == 1 else n],
+                                                axis=-1, zi=gain*zi)[0]
+            else:
+                x = power[0] if len(power) == 1 else power[rows]
+                zi = np.broadcast_to(zi, x.shape[:-1] + (1,))
+                filtered = scipy.signal.lfilter([1.0], [1.0, -pole], x, axis=-1, zi=zi)[0]
+                rise[rows] += b[rows, k, None, None]*filtered
+    return rise
+
+
+def calc_transient_network_batch(channelWidth, channelHeight, channelLength, baseThickness,
+                                 wallThickness, numSplits, numChannelsPerSplit, sourceWidth,
+                                 sourceArea, flowMode, flowRate, pressure, headloss, nuInf,
+                                 wallK, coolantK, coolantMu, coolantRho, coolantCp, wallRho, wallCp):
+    # calc_channel_perf_batch inputs plus the wall density [g/cm3] and heat
+    # capacity [J/g-K] to (RFoster, tau), flattened to (numDesigns, NUM_NODES)
+    perf = mb.calc_channel_perf_batch(channelWidth, channelHeight, channelLength, baseThickness,
+                                      wallThickness, numSplits, numChannelsPerSplit, sourceWidth,
+                                      sourceArea, flowMode, flowRate, pressure, headloss, nuInf,
+                                      wallK, coolantK, coolantMu, coolantRho, coolantCp)
+    R, C = calc_rc_network(channelWidth, channelHeight, channelLength, baseThickness, wallThickness,
+                           numSplits, numChannelsPerSplit, sourceArea, perf['RCond'], perf['RConv'],
+                           perf['RHeat'], wallRho, wallCp, coolantRho, coolantCp)
+    RFoster, tau = get_foster_network(R, C)
+    return RFoster.reshape(-1, NUM_NODES), tau.reshape(-1, NUM_NODES)
+
+
+def get_transient_network(models):
+    # (RFoster, tau) of a list of Microchannel objects
+    columns = mb.get_batch_columns(models)
+    columns['wallRho'] = np.array([m.thermalMaterial.rho for m in models], dtype=float)
+    columns['wallCp'] = np.array([m.thermalMaterial.cp for m in models], dtype=float)
+    return calc_transient_network_batch(**columns)
+
+
+def get_design_transient_network(designs):
+    # (RFoster, tau) of every design in a DesignSet
+    columns = designs.get_batch_columns()
+    columns['wallRho'] = designs.get_wall_property('rho')
+    columns['wallCp'] = designs.get_wall_property('cp')
+    return calc_transient_network_batch(**columns)
+
+
+def calc_junction_temperature(models, power, dt, initialPower = 0.0):
+    # source temperature [C] of a list of Microchannel objects for power
+    # waveforms, see calc_transient_response for the shapes
+    RFoster, tau = get_transient_network(models)
+    coolantT = np.array([m.coolant.coolantT for m in models], dtype=float)
+    return coolantT[:, None, None] + calc_transient_response(RFoster, tau, power, dt, initialPower)
@@ -0,0 +1,209 @@
+from __future__ import division
+import bisect
+import struct
+import numpy as np
+
+
+# File layout, little endian:
+#   header      magic, version, number of axes, number of outputs, number of error samples
+#   axes        per axis: name (32 bytes) and length
+#   outputs     per output: name (32 bytes)
+#   axis values float64, all axes one after the other
+#   errors      float64 max absolute and max relative error per output
+#   data        float64 array (outputs, n1, ..., nk), aligned to 64 bytes
+# The data block is memory-mapped on load, nothing is parsed beyond the header.
+RESPONSE_SURFACE_MAGIC = b'MCRS'
+RESPONSE_SURFACE_VERSION = 1
+NAME_SIZE = 32
+HEADER_FORMAT = '<4sIIII'
+DATA_ALIGNMENT = 64
+
+DEFAULT_OUTPUTS = ('RTotal', 'P', 'f', 'RConv', 'RHeat', 'v')
+COOLANT_AXES = ('coolantT', 'concPercent')
+
+
+class ResponseSurface:
+    """Precomputed calc_channel_perf outputs on a parameter grid with multilinear lookup"""
+
+    def __init__(self, axisNames, axes, outputNames, data, maxAbsError = None, maxRelError = None,
+                 numErrorSamples = 0):
+        self.axisNames = list(axisNames)
+        self.axes = [np.asarray(values, dtype=float) for values in axes]
+        self.outputNames = list(outputNames)
+        self.data = data            # (outputs, n1, ..., nk), may be a memmap
+        nan = [float('nan')]*len(self.outputNames)
+        self.maxAbsError = list(nan if maxAbsError is None else maxAbsError)
+        self.maxRelError = list(nan if maxRelError is None else maxRelError)
+        self.numErrorSamples = numErrorSamples
+        self._axisLists = [values.tolist() for values in self.axes]
+        self._outputIndex = dict((name, n) for n, name in enumerate(self.outputNames))
+        # plain flat view of the data and the element strides for query_point
+        self._flat = np.asarray(data).reshape(len(self.outputNames), -1)
+        self._strides = [int(np.prod([len(values) for values in self.axes[axis + 1:]]))
+                         for axis in range(len(self.axes))]
+
+    def get_error_bounds(self):
+        # name -> (max absolute error, max relative error) against the exact model,
+        # measured at random points inside the grid when the table was built
+        return dict((name, (self.maxAbsError[n], self.maxRelError[n]))
+                    for n, name in enumerate(self.outputNames))
+
+    def query(self, **coordinates):
+        # multilinear interpolation at arrays of coordinates, one keyword per axis;
+        # coordinates outside the grid are clamped and flagged in 'outOfRange'
+        points = np.broadcast_arrays(*[np.asarray(coordinates[name], dtype=float) for name in self.axisNames])
+        index = []
+        weight = []
+        outOfRange = np.zeros(points[0].shape, dtype=bool)
+        for values, x in zip(self.axes, points):
+            if len(values) == 1:
+                index.append(np.zeros(x.shape, dtype=int))
+                weight.append(np.zeros(x.shape))
+                outOfRange |= (x != values[0])
+                continue
+            n = np.clip(np.searchsorted(values, x, side='right') - 1, 0, len(values) - 2)
+            t = (x - values[n])/(values[n + 1] - values[n])
+            outOfRange |= (t < 0) | (t > 1)
+            index.append(n)
+            weight.append(np.clip(t, 0, 1))
+
+        result = dict((name, np.zeros(points[0].shape)) for name in self.outputNames)
+        for corner in range(2**len(self.axes)):
+            cornerIndex = []
+            cornerWeight = np.ones(points[0].shape)
+            for axis in range(len(self.axes)):
+                if (corner >> axis) & 1:
+                    if len(self.axes[axis]) == 1:
+                        cornerWeight = None
+                        break
+                    cornerIndex.append(index[axis] + 1)
+                    cornerWeight = cornerWeight*weight[axis]
+                else:
+                    cornerIndex.append(index[axis])
+                    cornerWeight = cornerWeight*(1 - weight[axis])
+            if cornerWeight is None:
+                continue
+            for n, name in enumerate(self.outputNames):
+                result[name] += cornerWeight*self.data[(n,) + tuple(cornerIndex)]
+        result['outOfRange'] = outOfRange
+        return result
+
+    def query_point(self, output, *coordinates):
+        # scalar lookup of one output without numpy overhead, coordinates in axis order
+        data = self._flat[self._outputIndex[output]]
+        base = 0
+        steps = []
+        weights = []
+        for values, stride, x in zip(self._axisLists, self._strides, coordinates):
+            if len(values) == 1:
+                continue
+            n = min(max(bisect.bisect_right(values, x) - 1, 0), len(values) - 2)
+            t = (x - values[n])/(values[n + 1] - values[n])
+            base += n*stride
+            steps.append(stride)
+            weights.append(min(max(t, 0.0), 1.0))
+        y = 0.0
+        for corner in range(2**len(steps)):
+            w = 1.0
+            offset = base
+            for axis in range(len(steps)):
+                if (corner >> axis) & 1:
+                    w *= weights[axis]
+                    offset += steps[axis]
+                else:
+                    w *= 1 - weights[axis]
+            if w != 0.0:
+                y += w*data.item(offset)
+        return y
+
+    def save(self, fileName):
+        with open(fileName, 'wb') as f:
+            f.write(struct.pack(HEADER_FORMAT, RESPONSE_SURFACE_MAGIC, RESPONSE_SURFACE_VERSION,
+                                len(self.axes), len(self.outputNames), self.numErrorSamples))
+            for name, values in zip(self.axisNames, self.axes):
+                f.write(struct.pack('<{0}sI'.format(NAME_SIZE), name.encode('ascii'), len(values)))
+            for name in self.outputNames:
+                f.write(struct.pack('<{0}s'.format(NAME_SIZE), name.encode('ascii')))
+            for values in self.axes:
+                f.write(values.astype('<f8').tobytes())
+            f.write(np.asarray(self.maxAbsError, dtype='<f8').tobytes())
+            f.write(np.asarray(self.maxRelError, dtype='<f8').tobytes())
+            f.write(b'\0'*(-f.tell() % DATA_ALIGNMENT))
+            f.write(np.ascontiguousarray(self.data, dtype='<f8').tobytes())
+
+
+def load_response_surface(fileName, mmap = True):
+    # open a table written by ResponseSurface.save; the data block is memory-mapped
+    with open(fileName, 'rb') as f:
+        magic, version, numAxes, numOutputs, numErrorSamples = struct.unpack(
+            HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != RESPONSE_SURFACE_MAGIC or version != RESPONSE_SURFACE_VERSION:
+            raise ValueError('not a response surface file: {0}'.format(fileName))
+        axisNames = []
+        axisLengths = []
+        for n in range(numAxes):
+            name, length = struct.unpack('<{0}sI'.format(NAME_SIZE), f.read(NAME_SIZE + 4))
+            axisNames.append(name.rstrip(b'\0').decode('ascii'))
+            axisLengths.append(length)
+        outputNames = [f.read(NAME_SIZE).rstrip(b'\0').decode('ascii') for n in range(numOutputs)]
+        axes = [np.frombuffer(f.read(8*length), dtype='<f8') for length in axisLengths]
+        maxAbsError = np.frombuffer(f.read(8*numOutputs), dtype='<f8').tolist()
+        maxRelError = np.frombuffer(f.read(8*numOutputs), dtype='<f8').tolist()
+        offset = f.tell() + (-f.tell() % DATA_ALIGNMENT)
+    shape = (numOutputs,) + tuple(axisLengths)
+    data = np.memmap(fileName, dtype='<f8', mode='r', offset=offset, shape=shape)
+    if not mmap:
+        data = np.array(data)
+    return ResponseSurface(axisNames, axes, outputNames, data, maxAbsError, maxRelError, numErrorSamples)
+
+
+def evaluate_model_points(model, points):
+    # exact calc_channel_perf outputs of a Microchannel with some inputs replaced by
+    # arrays; points may hold coolantT, concPercent and any calc_channel_perf_batch input
+    import microchannel_batch as mb
+    import coolant_properties as cpp
+    columns = mb.get_batch_columns([model])
+    for key in columns:
+        columns[key] = columns[key][0]
+    coolantT = points.get('coolantT', model.coolant.coolantT)
+    concPercent = points.get('concPercent', getattr(model.coolant, 'concPercent', 0))
+    if 'coolantT' in points or 'concPercent' in points:
+        coolant = cpp.calc_coolant_properties(model.coolant.name, coolantT, concPercent)
+        columns['coolantK'] = coolant['k']
+        columns['coolantMu'] = coolant['mu']
+        columns['coolantRho'] = coolant['rho']
+        columns['coolantCp'] = coolant['cp']
+    for key in points:
+        if key not in COOLANT_AXES:
+            if key not in columns:
+                raise ValueError('unknown response surface axis: {0}'.format(key))
+            columns[key] = points[key]
+    return mb.calc_channel_perf_batch(**columns)
+
+
+def build_response_surface(model, axes, outputs = DEFAULT_OUTPUTS, numErrorSamples = 2000, seed = 0):
+    # Evaluate a Microchannel on the grid spanned by axes, a list of (name, values)
+    # pairs such as [('flowRate', ...), ('coolantT', ...), ('concPercent', ...)].
+    # The error bounds of the multilinear interpolation are measured against the
+    # exact model at numErrorSamples random points inside the grid.
+    axisNames = [name for name, values in axes]
+    axisValues = [np.unique(np.asarray(values, dtype=float)) for name, values in axes]
+    grid = np.meshgrid(*axisValues, indexing='ij')
+    perf = evaluate_model_points(model, dict(zip(axisNames, grid)))
+    data = np.array([np.broadcast_to(perf[name], grid[0].shape) for name in outputs], dtype=float)
+    surface = ResponseSurface(axisNames, axisValues, outputs, data)
+
+    if numErrorSamples > 0:
+        rng = np.random.RandomState(seed)
+        points = dict((name, rng.uniform(values[0], values[-1], numErrorSamples))
+                      for name, values in zip(axisNames, axisValues))
+        exact = evaluate_model_points(model, points)
+        approx = surface.query(**points)
+        for n, name in enumerate(outputs):
+            error = np.abs(approx[name] - exact[name])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                relError = error/np.abs(exact[name])
+            surface.maxAbsError[n] = float(np.nanmax(error))
+            surface.maxRelError[n] = float(np.nanmax(relError))
+        surface.numErrorSamples = numErrorSamples
+    return surface
@@ -0,0 +1,179 @@
+from __future__ import division
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+import microchannel as mc
+import microchannel_batch as mb
+import instrumentation
+
+
+SQLITE_BATCH_SIZE = 500     # keys per SELECT, below the SQLite variable limit
+NUMERIC_KEYS = tuple(key for key in mb.BATCH_INPUT_KEYS if key != 'flowMode')
+FLOW_RATE_INDEX = NUMERIC_KEYS.index('flowRate')
+PRESSURE_INDEX = NUMERIC_KEYS.index('pressure')
+
+
+def get_design_keys(columns):
+    # content hashes of every design in a dict of calc_channel_perf_batch columns;
+    # numbers are hashed as float64 so 150 and 150.0 are the same design, flowMode
+    # ignores case and the model version is part of every key. The input a flow
+    # mode does not use, pressure in constFlow and flowRate in constPressure, is
+    # left out.
+    arrays = np.broadcast_arrays(*[np.asarray(columns[key]) for key in mb.BATCH_INPUT_KEYS])
+    arrays = dict(zip(mb.BATCH_INPUT_KEYS, [a.ravel() for a in arrays]))
+    values = np.ascontiguousarray(np.column_stack(
+        [arrays[key].astype(np.float64) for key in NUMERIC_KEYS]) + 0.0)      # + 0.0 folds -0.0
+    isConstP = mb.get_const_pressure_mask(arrays['flowMode'])
+    values[isConstP, FLOW_RATE_INDEX] = 0.0
+    values[~isConstP, PRESSURE_INDEX] = 0.0
+    prefix = ('microchannel/{0}/'.format(mc.MODEL_VERSION)).encode('utf-8')
+    keys = []
+    for n in range(len(values)):
+        h = hashlib.sha1(prefix)
+        h.update(b'P' if isConstP[n] else b'F')
+        h.update(values[n].tobytes())
+        keys.append(h.hexdigest())
+    return keys
+
+
+def get_design_key(inputs):
+    # content hash of the calc_channel_perf_batch inputs of one design
+    return get_design_keys(inputs)[0]
+
+
+class ResultCache:
+    """Two tier (in-memory LRU, SQLite file) cache of calc_channel_perf results"""
+
+    def __init__(self, fileName = None, maxSize = 100000, name = 'resultCache'):
+        self.fileName = fileName        # SQLite database shared between processes, None for memory only
+        self.maxSize = maxSize          # entries kept in the memory tier
+        self.stats = {'memoryHits':0, 'diskHits':0, 'misses':0, 'evictions':0, 'inserts':0}
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connectionPid = None
+        instrumentation.register_counters(name, self.get_stats)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['memorySize'] = len(self._memory)
+        return stats
+
+    def _get_connection(self):
+        # one connection per process, a forked child opens its own
+        if self.fileName == None:
+            return None
+        if self._connection == None or self._connectionPid != os.getpid():
+            connection = sqlite3.connect(self.fileName, timeout=60, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            connection.commit()
+            self._connection = connection
+            self._connectionPid = os.getpid()
+        return self._connection
+
+    def _remember(self, key, value):
+        if key in self._memory:
+            del self._memory[key]
+        self._memory[key] = value
+        while len(self._memory) > self.maxSize:
+            self._memory.popitem(last = False)
+            self.stats['evictions'] += 1
+
+    def get_many(self, keys):
+        # dict of the cached results for keys, missing keys are left out
+        found = {}
+        with self._lock:
+            remaining = []
+            for key in keys:
+                value = self._memory.get(key)
+                if value != None:
+                    self._remember(key, value)
+                    found[key] = value
+                    self.stats['memoryHits'] += 1
+                elif key not in found:
+                    remaining.append(key)
+
+            connection = self._get_connection()
+            if connection != None and remaining:
+                remaining = list(set(remaining))
+                for n in range(0, len(remaining), SQLITE_BATCH_SIZE):
+                    batch = remaining[n:n + SQLITE_BATCH_SIZE]
+                    rows = connection.execute('SELECT key, value FROM results WHERE key IN ({0})'.format(
+                        ','.join('?'*len(batch))), batch).fetchall()
+                    for key, text in rows:
+                        value = json.loads(text)
+                        self._remember(key, value)
+                        found[key] = value
+                        self.stats['diskHits'] += 1
+            self.stats['misses'] += sum(1 for key in keys if key not in found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        # store (key, channelPerf) pairs in both tiers
+        items = [(key, dict((k, float(v)) for k, v in value.items())) for key, value in items]
+        with self._lock:
+            for key, value in items:
+                self._remember(key, value)
+            connection = self._get_connection()
+            if connection != None and items:
+                with connection:
+                    connection.executemany('INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)',
+                                           [(key, json.dumps(value, sort_keys=True)) for key, value in items])
+            self.stats['inserts'] += len(items)
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def close(self):
+        if self._connection != None and self._connectionPid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+
+def cached_calc_channel_perf(model, cache):
+    # calc_channel_perf of a Microchannel through the cache, a copy the caller may change
+    key = get_design_key(mb.get_batch_columns([model]))
+    channelPerf = cache.get(key)
+    if channelPerf == None:
+        channelPerf = model.calc_channel_perf()
+        cache.put(key, channelPerf)
+    return dict(channelPerf)
+
+
+def cached_calc_channel_perf_batch(cache, **columns):
+    # calc_channel_perf_batch through the cache, only the designs that miss are computed
+    broadcast = dict(zip(mb.BATCH_INPUT_KEYS, np.broadcast_arrays(
+        *[np.atleast_1d(columns[key]) for key in mb.BATCH_INPUT_KEYS])))
+    shape = broadcast['channelWidth'].shape
+    keys = get_design_keys(broadcast)
+    found = cache.get_many(keys)
+
+    perf = dict((key, np.empty(len(keys))) for key in mb.CHANNEL_PERF_KEYS)
+    missing = [n for n, key in enumerate(keys) if key not in found]
+    if missing:
+        subset = dict((key, broadcast[key].ravel()[missing]) for key in mb.BATCH_INPUT_KEYS)
+        computed = mb.calc_channel_perf_batch(**subset)
+        items = {}
+        for i, n in enumerate(missing):
+            items[keys[n]] = dict((key, computed[key][i]) for key in mb.CHANNEL_PERF_KEYS)
+            for key in mb.CHANNEL_PERF_KEYS:
+                perf[key][n] = computed[key][i]
+        cache.put_many(items.items())
+    for n, key in enumerate(keys):
+        if key in found:
+            for perfKey in mb.CHANNEL_PERF_KEYS:
+                perf[perfKey][n] = found[key][perfKey]
+    return dict((key, perf[key].reshape(shape)) for key in perf)
@@ -1,8 +1,22 @@
+import array
+import bisect
+import collections
+import json
+import os
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 THERMAL_MATERIAL_JSON_FILE_NAME = 'thermal_constants_21c.json'
+THERMAL_MATERIAL_CACHE_FILE_NAME = None     # optional binary cache of the material table, off by default
 
 
-class Coolant:
+class Coolant(object):
     """Coolant class with properties"""
+
+    __slots__ = ('name', 'rho', 'k', 'cp', 'mu', 'fzT', 'coolantT', 'flowRate', 'flowUnit', 'concPercent')
     
     def __init__(self, name, coolantProperties = {'coolantT':25, 'flowRate':1000, 'concPercent':20}):
         self.name = name
@@ -18,35 +32,10 @@ class Coolant:
         else:
             self.coolantT = coolantProperties['coolantT']
             self.flowRate = coolantProperties['flowRate']
-            if name.lower() == 'air':
-                self.rho = get_air_rho(self.coolantT)
-                self.k = get_air_k(self.coolantT)
-                self.cp = get_air_cp(self.coolantT)
-                self.mu = get_air_mu(self.coolantT)
-                self.fzT = -273
-                self.flowUnit = 'cfm'
-            elif name.lower() == 'water':
-                self.rho = get_water_rho(self.coolantT)
-                self.k = get_water_k(self.coolantT)
-                self.cp = get_water_cp(self.coolantT)
-                self.mu = get_water_mu(self.coolantT)
-                self.fzT = 0
-                self.flowUnit = 'ccm'
-            elif name.lower() == 'egw':
+            if name.lower() == 'egw':
                 self.concPercent = coolantProperties['concPercent']      # concentration %
-                self.rho = get_egw_rho(self.coolantT, self.concPercent)
-                self.k = get_egw_k(self.coolantT, self.concPercent)
-                self.cp = get_egw_cp(self.coolantT, self.concPercent)
-                self.mu = get_egw_mu(self.coolantT, self.concPercent)
-                self.fzT = get_egw_fzt(self.concPercent)
-                self.flowUnit = 'ccm'
-            else:
-                self.rho = None
-                self.k = None
-                self.cp = None
-                self.mu = None
-                self.fzT = None
-                self.flowUnit = None
+            (self.rho, self.k, self.cp, self.mu, self.fzT, self.flowUnit) = get_coolant_state(
+                name, self.coolantT, coolantProperties.get('concPercent'))
 
     def calc_flow_rth(self):
         #calculate the flow thermal resistance in (C/W)
@@ -66,164 +55,154 @@ def interp1d(x, y, xi):
     elif xi >= x[len(x) - 1]:
         yi = y[len(x) - 1]
     else:
-        xn = (xj for xj in x if xj > xi).next()
-        n = x.index(xn)
+        n = bisect.bisect_right(x, xi)      # first point with x[n] > xi
         yi = y[n] - ((y[n] - y[n-1])/(x[n] - x[n-1]))*(x[n] - xi)
     return yi
 
 
-def get_air_rho(coolantT):
+# Coolant property tables, built once at import time
 # The following data are from Introduction to Heat Transfer Table A.4, pg. 757
-    x = [250, 300, 350, 400]
-    y = [1.3947, 1.1614, 0.9950, 0.8711]
-    xi = coolantT + 273
-    yi = interp1d(x, y, xi)*1e-3
-    return yi
+AIR_T = [250, 300, 350, 400]                    # temperature (K)
+AIR_RHO = [1.3947, 1.1614, 0.9950, 0.8711]      # density (kg/m3)
+AIR_K = [22.3, 26.3, 30.0, 33.8]                # thermal conductivity (1e-3 W/m-K)
+AIR_CP = [1.006, 1.007, 1.009, 1.014]           # specific heat (kJ/kg-K)
+AIR_MU = [159.6, 184.6, 208.2, 230.1]           # viscosity (1e-7 N-s/m2)
+
+# The following data are from Introduction to Heat Transfer Table A.6, pg. 764
+WATER_T = [273.15, 275, 280, 285, 290, 295, 300, 305, 310, 315, 320]                       # temperature (K)
+WATER_V = [1.000, 1.000, 1.000, 1.000, 1.001, 1.002, 1.003, 1.005, 1.007, 1.009, 1.011]    # specific volume (1e-3 m3/kg)
+WATER_RHO = [1.0/yn for yn in WATER_V]                                                      # density (g/cm3)
+WATER_K = [569, 574, 582, 590, 598, 606, 613, 620, 628, 634, 640]                          # thermal conductivity (1e-3 W/m-K)
+WATER_CP = [4.217, 4.211, 4.198, 4.189, 4.184, 4.181, 4.179, 4.178, 4.178, 4.179, 4.180]   # specific heat (kJ/kg-K)
+WATER_MU = [1750, 1652, 1422, 1225, 1080, 959, 855, 769, 695, 631, 577]                    # viscosity (1e-6 N-s/m2)
+
+# The following data are from the Handbook of Tables for Applied Engineering Science
+# (pg. 96, Table 1-51. Antifreeze Solutions)
+EGW_T = [0, 20]                                 # temperature of the tabulated rows (C)
+EGW_CONC = [10, 20, 30, 40, 50]                 # concentration (%)
+EGW_RHO = [1.012, 1.025, 1.040, 1.055, 1.065]   # density (g/cm3)
+EGW_K0 = [0.32, 0.30, 0.28, 0.26, 0.24]         # k vs concentration at 0 degree C (BTU/hr-ft-F)
+EGW_K20 = [0.33, 0.31, 0.28, 0.26, 0.24]        # k vs concentration at 20 degree C
+EGW_CP0 = [0.96, 0.93, 0.87, 0.81, 0.76]        # cp vs concentration at 0 degree C (BTU/lb-F)
+EGW_CP20 = [0.97, 0.94, 0.89, 0.84, 0.79]       # cp vs concentration at 20 degree C
+EGW_MU0 = [2.5, 3.0, 4.0, 5.3, 8.0]             # mu vs concentration at 0 degree C (cP)
+EGW_MU20 = [1.4, 1.9, 2.4, 3.1, 4.1]            # mu vs concentration at 20 degree C
+EGW_FZT = [(tF - 32)*(5/9) for tF in [24, 15, 4, -12, -32]]    # freezing temperature (C)
+
+
+def get_air_rho(coolantT):
+    return interp1d(AIR_T, AIR_RHO, coolantT + 273)*1e-3
 
 def get_air_k(coolantT):
-    # The following data are from Introduction to Heat Transfer Table A.4, pg. 757
-    x = [250, 300, 350, 400]
-    y = [22.3, 26.3, 30.0, 33.8]
-    xi = coolantT + 273
-    yi = interp1d(x, y, xi)*1e-5
-    return yi
+    return interp1d(AIR_T, AIR_K, coolantT + 273)*1e-5
 
 
 def get_air_cp(coolantT):
-    # The following data are from Introduction to Heat Transfer Table A.4, pg. 757
-    x = [250, 300, 350, 400]
-    y = [1.006, 1.007, 1.009, 1.014]
-    xi = coolantT + 273
-    yi = interp1d(x, y, xi)
-    return yi
+    return interp1d(AIR_T, AIR_CP, coolantT + 273)
 
 
 def get_air_mu(coolantT):
-    # The following data are from Introduction to Heat Transfer Table A.4, pg. 757
-    x = [250, 300, 350, 400]
-    y = [159.6, 184.6, 208.2, 230.1]
-    xi = coolantT + 273
-    yi = interp1d(x, y, xi)*1e-11
-    return yi
+    return interp1d(AIR_T, AIR_MU, coolantT + 273)*1e-11
 
 def get_water_rho(coolantT):
-    # The following data are from Introduction to Heat Transfer Table A.6, pg. 764
-    x = [273.15, 275, 280, 285, 290, 295, 300, 305, 310, 315, 320]
-    y = [1.000, 1.000, 1.000, 1.000, 1.001, 1.002, 1.003, 1.005, 1.007, 1.009, 1.011]
-    yinv = []
-    for yn in y:
-        yinv.append(1.0/yn)
-    xi = coolantT + 273
-    yi = interp1d(x, yinv, xi)
-    return yi
+    return interp1d(WATER_T, WATER_RHO, coolantT + 273)
 
 def get_water_k(coolantT):
-    # The following data are from Introduction to Heat Transfer Table A.6, pg. 764
-    x = [273.15, 275, 280, 285, 290, 295, 300, 305, 310, 315, 320]
-    y = [569, 574, 582, 590, 598, 606, 613, 620, 628, 634, 640]
-    xi = coolantT + 273
-    yi = interp1d(x, y, xi)*1e-5
-    return yi
+    return interp1d(WATER_T, WATER_K, coolantT + 273)*1e-5
 
 
 def get_water_cp(coolantT):
-    # The following data are from Introduction to Heat Transfer Table A.6, pg. 764
-    x = [273.15, 275, 280, 285, 290, 295, 300, 305, 310, 315, 320]
-    y = [4.217, 4.211, 4.198, 4.189, 4.184, 4.181, 4.179, 4.178, 4.178, 4.179, 4.180]
-    xi = coolantT + 273
-    yi = interp1d(x, y, xi)
-    return yi
+    return interp1d(WATER_T, WATER_CP, coolantT + 273)
 
 
 def get_water_mu(coolantT):
-    # The following data are from Introduction to Heat Transfer Table A.6, pg. 764
-    x = [273.15, 275, 280, 285, 290, 295, 300, 305, 310, 315, 320]
-    y = [1750, 1652, 1422, 1225, 1080, 959, 855, 769, 695, 631, 577]
-    xi = coolantT + 273
-    yi = interp1d(x, y, xi)*1e-10
-    return yi
+    return interp1d(WATER_T, WATER_MU, coolantT + 273)*1e-10
 
 
 def get_egw_rho(coolantT, concPercent):
-    # The following data are from the Handbook of Tables for Applied Engineering Science
-    # (pg. 96, Table 1-51. Antifreeze Solutions)
-    x = [10, 20, 30, 40, 50]
-    y = [1.012, 1.025, 1.040, 1.055, 1.065]
-    yi = interp1d(x, y, concPercent)
-    return yi
+    return interp1d(EGW_CONC, EGW_RHO, concPercent)
 
 def get_egw_k(coolantT, concPercent):
-    # The following data are from the Handbook of Tables for Applied Engineering Science
-    # (pg. 96, Table 1-51. Antifreeze Solutions)
-    x = [10, 20, 30, 40, 50]
-    y0 = [0.32, 0.30, 0.28, 0.26, 0.24]     # k vs concentration at 0 degree C
-    y20 = [0.33, 0.31, 0.28, 0.26, 0.24]     # k vs concentration at 20 degree C
-    yi0 = interp1d(x, y0, concPercent)*1.7296/100
-    yi20 = interp1d(x, y20, concPercent)*1.7296/100
-    x = [0, 20]
-    y = [yi0, yi20]
-    yi = interp1d(x, y, coolantT)
-    return yi
+    yi0 = interp1d(EGW_CONC, EGW_K0, concPercent)*1.7296/100
+    yi20 = interp1d(EGW_CONC, EGW_K20, concPercent)*1.7296/100
+    return interp1d(EGW_T, [yi0, yi20], coolantT)
 
 
 def get_egw_cp(coolantT, concPercent):
-    # The following data are from the Handbook of Tables for Applied Engineering Science
-    # (pg. 96, Table 1-51. Antifreeze Solutions)
-    x = [10, 20, 30, 40, 50]
-    y0 = [0.96, 0.93, 0.87, 0.81, 0.76]     # cp vs concentration at 0 degree C
-    y20 = [0.97, 0.94, 0.89, 0.84, 0.79]     # cp vs concentration at 20 degree C
-    yi0 = interp1d(x, y0, concPercent)*4.184
-    yi20 = interp1d(x, y20, concPercent)*4.184
-    x = [0, 20]
-    y = [yi0, yi20]
-    yi = interp1d(x, y, coolantT)
-    return yi
+    yi0 = interp1d(EGW_CONC, EGW_CP0, concPercent)*4.184
+    yi20 = interp1d(EGW_CONC, EGW_CP20, concPercent)*4.184
+    return interp1d(EGW_T, [yi0, yi20], coolantT)
 
 
 def get_egw_mu(coolantT, concPercent):
-    # The following data are from the Handbook of Tables for Applied Engineering Science
-    # (pg. 96, Table 1-51. Antifreeze Solutions)
-    x = [10, 20, 30, 40, 50]
-    y0 = [2.5, 3.0, 4.0, 5.3, 8.0]     # mu vs concentration at 0 degree C
-    y20 = [1.4, 1.9, 2.4, 3.1, 4.1]     # mu vs concentration at 20 degree C
-    yi0 = interp1d(x, y0, concPercent)*1e-7
-    yi20 = interp1d(x, y20, concPercent)*1e-7
-    x = [0, 20]
-    y = [yi0, yi20]
-    yi = interp1d(x, y, coolantT)
-    return yi
+    yi0 = interp1d(EGW_CONC, EGW_MU0, concPercent)*1e-7
+    yi20 = interp1d(EGW_CONC, EGW_MU20, concPercent)*1e-7
+    return interp1d(EGW_T, [yi0, yi20], coolantT)
 
 
 def get_egw_fzt(concPercent):
-    # The following data are from the Handbook of Tables for Applied Engineering Science
-    # (pg. 96, Table 1-51. Antifreeze Solutions)
-    x = [10, 20, 30, 40, 50]
-    yF = [24, 15, 4, -12, -32]
-    y = []
-    for tF in yF:
-        y.append((tF - 32)*(5/9))
-    yi = interp1d(x, y, concPercent)
-    return yi
+    return interp1d(EGW_CONC, EGW_FZT, concPercent)
+
+
+COOLANT_STATE_CACHE_SIZE = 4096     # maximum number of memoized coolant states
+_coolantStates = collections.OrderedDict()
+coolantStateStats = {'hits':0, 'misses':0, 'evictions':0}
+
+
+def get_coolant_state(name, coolantT, concPercent = None):
+    # coolant properties (rho, k, cp, mu, fzT, flowUnit) at a temperature and,
+    # for EGW, a concentration; states are memoized on (name, coolantT, concPercent)
+    name = name.lower()
+    key = (name, coolantT, concPercent if name == 'egw' else None)
+    state = _coolantStates.get(key)
+    if state != None:
+        coolantStateStats['hits'] += 1
+        return state
+
+    coolantStateStats['misses'] += 1
+    if name == 'air':
+        state = (get_air_rho(coolantT), get_air_k(coolantT), get_air_cp(coolantT),
+                 get_air_mu(coolantT), -273, 'cfm')
+    elif name == 'water':
+        state = (get_water_rho(coolantT), get_water_k(coolantT), get_water_cp(coolantT),
+                 get_water_mu(coolantT), 0, 'ccm')
+    elif name == 'egw':
+        state = (get_egw_rho(coolantT, concPercent), get_egw_k(coolantT, concPercent),
+                 get_egw_cp(coolantT, concPercent), get_egw_mu(coolantT, concPercent),
+                 get_egw_fzt(concPercent), 'ccm')
+    else:
+        state = (None, None, None, None, None, None)
+
+    if len(_coolantStates) >= COOLANT_STATE_CACHE_SIZE:
+        _coolantStates.popitem(last = False)
+        coolantStateStats['evictions'] += 1
+    _coolantStates[key] = state
+    return state
+
+
+def clear_coolant_states():
+    _coolantStates.clear()
 
 
 
-class ThermalMaterial:
+class ThermalMaterial(object):
     """Thermal material class with thermal properties"""
+
+    __slots__ = ('name', 'rho', 'k', 'cp', 'alpha')
     
     def __init__(self, name, thermalProperties = None):
         if thermalProperties == None:
-            import json
-        
             try:
-                with open(THERMAL_MATERIAL_JSON_FILE_NAME, 'r') as f:
-                    dict = json.load(f)
-                x = (item for item in dict if item['Name'].lower() == name.lower()).next()
+                x = get_material_registry().get_material(name)
+            except (IOError, OSError, ValueError, KeyError):
+                x = None
+            if x != None:
                 self.name = x['Name']
                 self.rho = x['Density (g/cm3)']
                 self.k = x['Thermal Conductivity (W/cm-K)']
                 self.cp = x['Specific Heat (J/g-K)']
                 self.alpha = x['Linear Expansion (um/cm/C)']
-            except:
+            else:
                 self.name = None
                 self.rho = None
                 self.k = None
@@ -237,26 +216,129 @@ class ThermalMaterial:
             self.alpha = thermalProperties['alpha']
 
 
+class MaterialRegistry:
+    """Thermal material table loaded once per process and indexed by name"""
+
+    def __init__(self, jsonFileName = None, cacheFileName = None):
+        self.jsonFileName = jsonFileName        # material table, defaults to THERMAL_MATERIAL_JSON_FILE_NAME
+        self.cacheFileName = cacheFileName      # optional precompiled binary copy of the table
+        self.names = None       # material names in table order
+        self.rho = None         # density (g/cm3), array of doubles, nan if missing
+        self.k = None           # thermal conductivity (W/cm-K)
+        self.cp = None          # specific heat (J/g-K)
+        self.alpha = None       # linear expansion (um/cm/C)
+        self.stats = {'jsonLoads':0, 'cacheLoads':0, 'cacheWrites':0, 'lookups':0, 'lookupMisses':0}
+        self._items = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        # parse the material table on first use, later calls return immediately
+        if self._index != None:
+            return
+        with self._lock:
+            if self._index != None:
+                return
+            jsonFileName = get_data_file_path(self.jsonFileName or THERMAL_MATERIAL_JSON_FILE_NAME)
+            cacheFileName = self.cacheFileName or THERMAL_MATERIAL_CACHE_FILE_NAME
+            if cacheFileName:
+                items = self._load_cached(jsonFileName, get_data_file_path(cacheFileName))
+            else:
+                items = self._load_json(jsonFileName)
+
+            self.names = [item['Name'] for item in items]
+            self.rho = self._get_column(items, 'Density (g/cm3)')
+            self.k = self._get_column(items, 'Thermal Conductivity (W/cm-K)')
+            self.cp = self._get_column(items, 'Specific Heat (J/g-K)')
+            self.alpha = self._get_column(items, 'Linear Expansion (um/cm/C)')
+            self._items = items
+            self._index = dict((name.lower(), n) for n, name in enumerate(self.names))
+
+    def get_index(self, name):
+        # position of a material in the property arrays, None if not found
+        self.load()
+        self.stats['lookups'] += 1
+        try:
+            n = self._index.get(name.lower())
+        except AttributeError:
+            n = None        # not a name, e.g. None
+        if n == None:
+            self.stats['lookupMisses'] += 1
+        return n
+
+    def get_material(self, name):
+        # material table entry (dict keyed like the JSON file), None if not found
+        n = self.get_index(name)
+        if n == None:
+            return None
+        return self._items[n]
+
+    def get_material_list(self):
+        self.load()
+        return sorted(self.names)
+
+    def _load_json(self, jsonFileName):
+        with open(jsonFileName, 'r') as f:
+            items = json.load(f)
+        self.stats['jsonLoads'] += 1
+        return items
+
+    def _load_cached(self, jsonFileName, cacheFileName):
+        # use the binary cache when it was built from the current JSON file,
+        # otherwise parse the JSON and rebuild the cache next to it
+        st = os.stat(jsonFileName)
+        source = (os.path.abspath(jsonFileName), st.st_mtime, st.st_size)
+        try:
+            with open(cacheFileName, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['source'] == source:
+                self.stats['cacheLoads'] += 1
+                return cached['items']
+        except Exception:
+            pass
+
+        items = self._load_json(jsonFileName)
+        try:
+            tmpFileName = '{0}.{1}.tmp'.format(cacheFileName, os.getpid())
+            with open(tmpFileName, 'wb') as f:
+                pickle.dump({'source':source, 'items':items}, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpFileName, cacheFileName)
+            self.stats['cacheWrites'] += 1
+        except (IOError, OSError):
+            pass    # an unwritable cache only costs the JSON parse
+        return items
+
+    @staticmethod
+    def _get_column(items, key):
+        column = array.array('d')
+        for item in items:
+            value = item[key]
+            column.append(float('nan') if value == None else value)
+        return column
+
+
+def get_data_file_path(fileName):
+    # data files are looked up next to this module unless given with a path
+    if os.path.isabs(fileName) or os.path.dirname(fileName):
+        return fileName
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), fileName)
+
+
+_materialRegistry = MaterialRegistry()
+
+
+def get_material_registry():
+    return _materialRegistry
+
+
+def set_material_registry(materialRegistry):
+    # replace the process-wide registry, e.g. to enable the binary cache
+    global _materialRegistry
+    _materialRegistry = materialRegistry
+
+
 def get_material_list():
-    import json
-            
     try:
-        with open(THERMAL_MATERIAL_JSON_FILE_NAME, 'r') as f:
-            dict = json.load(f)
-        materialList = []
-        for item in dict:
-            materialList.append(item['Name'])
-        materialList.sort()
-        return materialList
-    except:
+        return get_material_registry().get_material_list()
+    except (IOError, OSError, ValueError, KeyError):
         return None
-
-
-
-
-
-
-
-
-
-